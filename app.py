@@ -1,53 +1,149 @@
 # Importación de librerías 
-from flask import Flask, render_template, request, jsonify, redirect, url_for, send_file, make_response
+from flask import Flask, render_template, request, jsonify, redirect, url_for, send_file, make_response, Response
+from flask.json.provider import DefaultJSONProvider
 # Removemos CORS para evitar problemas
 from database.models import DatabaseManager  # manejar la base de datos
+from database.columnar import ColumnarSnapshot, segundos_epoch  # lecturas analíticas columnar
+from database.analisis import comparar_actividad_inactividad
+from database.espacial import IndiceEstaciones
+from database.impactos import (calcular_significancia, factorizar_componentes,
+                               matriz_aspecto_componente)
+from validacion import validar_numero, validar_timestamp  # compartido con receptor_sensores.py
 import json
 import csv
 import io
 import os
 import logging
+import itertools
+import zlib
 from datetime import datetime, timedelta
 from reportlab.lib.pagesizes import letter, A4
 from reportlab.lib import colors
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
 from reportlab.lib.units import inch
+import numpy as np
 import pandas as pd
 
+# Dependencias opcionales: sin ellas se usa el JSON de Flask y solo gzip
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
 # Configuración de logging para debugging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+class ORJSONProvider(DefaultJSONProvider):
+    """Serializa las respuestas JSON con orjson (varias veces más rápido que json)"""
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(
+            obj,
+            default=self.default,
+            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        ).decode('utf-8')
+
 # Inicialización de la aplicación Flask
 app = Flask(__name__)
+if orjson:
+    app.json = ORJSONProvider(app)
 
 # Configuración de seguridad básica
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'clave-desarrollo-cambiar-en-produccion')
 
+# Caché de páginas renderizadas (desactivar con CACHE_PLANTILLAS=0 al editar plantillas)
+app.config['CACHE_PLANTILLAS'] = os.environ.get('CACHE_PLANTILLAS', '1') == '1'
+
 # Inicialización de la base de datos
 db = DatabaseManager()
 
+# Snapshot columnar (memmap) para gráficos y resúmenes
+snapshot = ColumnarSnapshot(db)
+
 # ==================== UTILIDADES Y HELPERS ====================
 
-def validar_numero(valor, nombre_campo="valor"):
+def sincronizar_snapshot():
+    """Agrega al snapshot columnar las mediciones recién confirmadas"""
+    try:
+        snapshot.sync()
+    except Exception as e:
+        # El snapshot se vuelve a sincronizar en la próxima lectura
+        logger.error(f"Error al sincronizar snapshot columnar: {e}")
+
+# Caché por versiones de tablas: nombre -> (clave de versiones, valor calculado)
+cache_versionado = {}
+
+def obtener_con_cache(nombre, tablas, calcular, extra=()):
     """
-    Valida que un valor sea un número válido
+    Reutiliza un valor calculado mientras las tablas de las que depende no cambien
     Args:
-        valor: El valor a validar
-        nombre_campo: Nombre del campo para el mensaje de error
+        nombre: Identificador de la entrada de caché
+        tablas: Tablas de las que depende el valor
+        calcular: Función que consulta la base y devuelve el valor
+        extra: Valores adicionales para la clave (por ejemplo, la fecha del día)
     Returns:
-        float: El valor convertido a float
-    Raises:
-        ValueError: Si el valor no es válido
+        El valor guardado o recién calculado
     """
-    try:
-        numero = float(valor)
-        if numero < -100 or numero > 1000:  # Rango razonable para datos ambientales
-            raise ValueError(f"{nombre_campo} fuera del rango válido (-100 a 1000)")
-        return numero
-    except (ValueError, TypeError):
-        raise ValueError(f"{nombre_campo} debe ser un número válido")
+    # Las versiones se leen antes de calcular: si hay una escritura en medio,
+    # la clave guardada queda atrasada y la siguiente llamada vuelve a calcular
+    versiones = db.get_table_versions()
+    clave = tuple(versiones.get(tabla) for tabla in tablas) + tuple(extra)
+    
+    entrada = cache_versionado.get(nombre)
+    if entrada and entrada[0] == clave:
+        return entrada[1]
+    
+    valor = calcular()
+    cache_versionado[nombre] = (clave, valor)
+    return valor
+
+def renderizar_con_cache(plantilla, tablas, obtener_contexto, extra=()):
+    """
+    Renderiza una plantilla reutilizando el HTML mientras sus tablas no cambien.
+    El HTML incluye URLs de la petición (request.url_root, url_for), por eso la
+    raíz de la aplicación también forma parte de la clave.
+    Junto al HTML se guarda el cuerpo comprimido de cada codificación ya pedida,
+    así una página en caché no se vuelve a comprimir en cada visita.
+    Args:
+        plantilla: Nombre del archivo de plantilla
+        tablas: Tablas de las que dependen los datos de la página
+        obtener_contexto: Función que consulta la base y devuelve el contexto
+        extra: Valores adicionales para la clave (por ejemplo, la fecha del día)
+    Returns:
+        Response con el HTML renderizado (str si la caché está desactivada)
+    """
+    if not app.config['CACHE_PLANTILLAS']:
+        return render_template(plantilla, **obtener_contexto())
+    
+    # pagina: {'html': bytes, 'comprimidos': {codificacion: bytes}}
+    pagina = obtener_con_cache(
+        f'plantilla:{plantilla}',
+        tablas,
+        lambda: {
+            'html': render_template(plantilla, **obtener_contexto()).encode('utf-8'),
+            'comprimidos': {}
+        },
+        tuple(extra) + (request.url_root, request.script_root)
+    )
+    
+    response = make_response(pagina['html'])
+    response.vary.add('Accept-Encoding')
+    codificacion = elegir_codificacion()
+    if codificacion and len(pagina['html']) >= TAMANO_MINIMO_COMPRESION:
+        cuerpo = pagina['comprimidos'].get(codificacion)
+        if cuerpo is None:
+            cuerpo = pagina['comprimidos'][codificacion] = comprimir(pagina['html'], codificacion)
+        # Con Content-Encoding presente comprimir_respuesta() no la vuelve a comprimir
+        response.set_data(cuerpo)
+        response.headers['Content-Encoding'] = codificacion
+    return response
 
 def registrar_visita():
     """Registra la visita del usuario en el log"""
@@ -110,83 +206,169 @@ def obtener_estadisticas_rapidas():
             'ultimo_registro': None
         }
 
+# ==================== COMPRESIÓN DE RESPUESTAS ====================
+
+TIPOS_COMPRIMIBLES = {'application/json', 'text/csv', 'text/html', 'text/plain'}
+TAMANO_MINIMO_COMPRESION = 500  # bytes; por debajo la cabecera gzip no compensa
+
+def elegir_codificacion():
+    """Elige br o gzip según Accept-Encoding del cliente (None si no acepta ninguno)"""
+    disponibles = ['br', 'gzip'] if brotli else ['gzip']
+    return request.accept_encodings.best_match(disponibles)
+
+def gzip_compresor():
+    """Compresor zlib con cabecera gzip (wbits=31)"""
+    return zlib.compressobj(6, zlib.DEFLATED, 31)
+
+def comprimir(datos, codificacion):
+    """Comprime un cuerpo completo"""
+    if codificacion == 'br':
+        return brotli.compress(datos, quality=5)
+    compresor = gzip_compresor()
+    return compresor.compress(datos) + compresor.flush()
+
+def comprimir_stream(partes, codificacion):
+    """Comprime una respuesta en streaming parte por parte, sin armarla en memoria"""
+    if codificacion == 'br':
+        compresor = brotli.Compressor(quality=5)
+        comprimir_parte, finalizar = compresor.process, compresor.finish
+    else:
+        compresor = gzip_compresor()
+        comprimir_parte, finalizar = compresor.compress, compresor.flush
+    
+    try:
+        for parte in partes:
+            if isinstance(parte, str):
+                parte = parte.encode('utf-8')
+            salida = comprimir_parte(parte)
+            if salida:
+                yield salida
+        yield finalizar()
+    finally:
+        # Cierra el generador original (y su conexión) si el cliente corta la descarga
+        if hasattr(partes, 'close'):
+            partes.close()
+
+@app.after_request
+def comprimir_respuesta(response):
+    """Comprime JSON, CSV y HTML cuando el cliente lo acepta"""
+    if (response.status_code != 200
+            or response.direct_passthrough
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in TIPOS_COMPRIMIBLES):
+        return response
+    
+    response.vary.add('Accept-Encoding')
+    codificacion = elegir_codificacion()
+    if not codificacion:
+        return response
+    
+    if response.is_streamed:
+        response.response = comprimir_stream(response.response, codificacion)
+        response.headers.pop('Content-Length', None)
+    else:
+        datos = response.get_data()
+        if len(datos) < TAMANO_MINIMO_COMPRESION:
+            return response
+        response.set_data(comprimir(datos, codificacion))
+    
+    response.headers['Content-Encoding'] = codificacion
+    return response
+
 # ==================== RUTAS PRINCIPALES ====================
 
 @app.route('/')
 def index():
     """Página principal del sistema"""
     registrar_visita()
-    estadisticas = obtener_estadisticas_rapidas()
-    return render_template('index.html', estadisticas=estadisticas)
+    # Las mediciones de hoy cambian de día aunque la tabla no cambie
+    return renderizar_con_cache(
+        'index.html',
+        ('mediciones', 'estaciones_monitoreo'),
+        lambda: {'estadisticas': obtener_estadisticas_rapidas()},
+        extra=(datetime.now().date(),)
+    )
+
+def contexto_monitoreo():
+    """Consulta los catálogos que necesita el formulario de monitoreo"""
+    conn = db.get_connection()
+    cursor = conn.cursor()
+    
+    # Obtener estaciones activas
+    cursor.execute("SELECT * FROM estaciones_monitoreo WHERE estado = 'activa'")
+    estaciones = cursor.fetchall()
+    
+    # Obtener parámetros disponibles
+    cursor.execute("SELECT * FROM parametros_ambientales ORDER BY nombre_parametro")
+    parametros = cursor.fetchall()
+    
+    conn.close()
+    
+    return {'estaciones': estaciones, 'parametros': parametros}
 
 @app.route('/monitoreo')
 def monitoreo():
     """Página del formulario de monitoreo"""
     try:
-        conn = db.get_connection()
-        cursor = conn.cursor()
-        
-        # Obtener estaciones activas
-        cursor.execute("SELECT * FROM estaciones_monitoreo WHERE estado = 'activa'")
-        estaciones = cursor.fetchall()
-        
-        # Obtener parámetros disponibles
-        cursor.execute("SELECT * FROM parametros_ambientales ORDER BY nombre_parametro")
-        parametros = cursor.fetchall()
-        
-        conn.close()
-        
-        return render_template('monitoreo.html', 
-                             estaciones=estaciones, 
-                             parametros=parametros)
+        return renderizar_con_cache(
+            'monitoreo.html',
+            ('estaciones_monitoreo', 'parametros_ambientales'),
+            contexto_monitoreo
+        )
     except Exception as e:
         logger.error(f"Error en página monitoreo: {e}")
         return render_template('error.html', 
                              mensaje="Error al cargar la página de monitoreo"), 500
 
+def contexto_reportes():
+    """Consulta las últimas mediciones y el resumen por parámetro"""
+    conn = db.get_connection()
+    cursor = conn.cursor()
+    
+    # Obtener las últimas 50 mediciones con información completa
+    cursor.execute('''
+        SELECT m.fecha_medicion, e.nombre_estacion, p.nombre_parametro, 
+               m.valor_medido, p.unidad_medida, p.valor_limite_permisible,
+               m.responsable_medicion,
+               CASE 
+                   WHEN m.valor_medido > p.valor_limite_permisible THEN 'Excede límite'
+                   ELSE 'Normal'
+               END as estado
+        FROM mediciones m
+        JOIN estaciones_monitoreo e ON m.id_estacion = e.id_estacion
+        JOIN parametros_ambientales p ON m.id_parametro = p.id_parametro
+        ORDER BY m.fecha_medicion DESC
+        LIMIT 50
+    ''')
+    
+    mediciones = cursor.fetchall()
+    
+    cursor.execute("SELECT id_parametro, nombre_parametro FROM parametros_ambientales")
+    parametros = cursor.fetchall()
+    conn.close()
+    
+    # Resumen por parámetro de los últimos 30 días desde el snapshot columnar
+    sincronizar_snapshot()
+    desde = datetime.now() - timedelta(days=30)
+    resumen_parametros = []
+    for id_parametro, nombre in parametros:
+        resumen = snapshot.summary(id_parametro, desde)
+        if resumen:
+            resumen_parametros.append((nombre,) + resumen)
+    
+    return {'mediciones': mediciones, 'resumen_parametros': resumen_parametros}
+
 @app.route('/reportes')
 def reportes():
     """Página de reportes y visualización"""
     try:
-        conn = db.get_connection()
-        cursor = conn.cursor()
-        
-        # Obtener las últimas 50 mediciones con información completa
-        cursor.execute('''
-            SELECT m.fecha_medicion, e.nombre_estacion, p.nombre_parametro, 
-                   m.valor_medido, p.unidad_medida, p.valor_limite_permisible,
-                   m.responsable_medicion,
-                   CASE 
-                       WHEN m.valor_medido > p.valor_limite_permisible THEN 'Excede límite'
-                       ELSE 'Normal'
-                   END as estado
-            FROM mediciones m
-            JOIN estaciones_monitoreo e ON m.id_estacion = e.id_estacion
-            JOIN parametros_ambientales p ON m.id_parametro = p.id_parametro
-            ORDER BY m.fecha_medicion DESC
-            LIMIT 50
-        ''')
-        
-        mediciones = cursor.fetchall()
-        
-        # Obtener resumen por parámetro
-        cursor.execute('''
-            SELECT p.nombre_parametro, COUNT(*) as total_mediciones,
-                   AVG(m.valor_medido) as promedio,
-                   MIN(m.valor_medido) as minimo,
-                   MAX(m.valor_medido) as maximo
-            FROM mediciones m
-            JOIN parametros_ambientales p ON m.id_parametro = p.id_parametro
-            WHERE m.fecha_medicion >= datetime('now', '-30 days')
-            GROUP BY p.nombre_parametro
-        ''')
-        
-        resumen_parametros = cursor.fetchall()
-        conn.close()
-        
-        return render_template('reportes.html', 
-                             mediciones=mediciones,
-                             resumen_parametros=resumen_parametros)
+        # El resumen cubre los últimos 30 días, por eso la fecha entra en la clave
+        return renderizar_con_cache(
+            'reportes.html',
+            ('mediciones', 'estaciones_monitoreo', 'parametros_ambientales'),
+            contexto_reportes,
+            extra=(datetime.now().date(),)
+        )
     except Exception as e:
         logger.error(f"Error en página reportes: {e}")
         return render_template('error.html', 
@@ -241,6 +423,7 @@ def agregar_medicion():
         conn.commit()
         medicion_id = cursor.lastrowid
         conn.close()
+        sincronizar_snapshot()
         
         logger.info(f"Nueva medición agregada - ID: {medicion_id}, Valor: {valor_medido}")
         
@@ -348,27 +531,28 @@ def datos_recientes():
 
 @app.route('/api/datos_grafico/<parametro>')
 def datos_grafico_parametro(parametro):
-    """Obtiene datos históricos de un parámetro específico para gráficos"""
+    """
+    Obtiene datos históricos de un parámetro específico para gráficos.
+    Con ?formato=columnar devuelve arreglos paralelos {'fecha': [...], 'valor': [...], ...}
+    en lugar de una lista de objetos, lo que evita repetir las claves en cada punto.
+    """
+    columnar = request.args.get('formato') == 'columnar'
     try:
         conn = db.get_connection()
         cursor = conn.cursor()
         
-        # Obtener datos de los últimos 30 días
         cursor.execute('''
-            SELECT DATE(m.fecha_medicion) as fecha, 
-                   AVG(m.valor_medido) as promedio,
-                   COUNT(*) as cantidad_mediciones
-            FROM mediciones m
-            JOIN parametros_ambientales p ON m.id_parametro = p.id_parametro
-            WHERE p.nombre_parametro LIKE ?
-            AND m.fecha_medicion >= datetime('now', '-30 days')
-            GROUP BY DATE(m.fecha_medicion)
-            ORDER BY fecha ASC
+            SELECT id_parametro FROM parametros_ambientales
+            WHERE nombre_parametro LIKE ?
         ''', (f'%{parametro}%',))
         
-        datos = cursor.fetchall()
+        ids_parametros = [fila[0] for fila in cursor.fetchall()]
         conn.close()
         
+        # Promedios diarios de los últimos 30 días desde el snapshot columnar
+        sincronizar_snapshot()
+        datos = snapshot.daily_means(ids_parametros, datetime.now() - timedelta(days=30))
+        
         if not datos:
             # Generar datos de ejemplo para demostración
             fechas_ejemplo = []
@@ -379,11 +563,23 @@ def datos_grafico_parametro(parametro):
                 fechas_ejemplo.append(fecha)
                 valores_ejemplo.append(valor)
             
+            if columnar:
+                return jsonify({'fecha': fechas_ejemplo, 'valor': valores_ejemplo})
+            
             return jsonify([
                 {'fecha': fecha, 'valor': valor} 
                 for fecha, valor in zip(fechas_ejemplo, valores_ejemplo)
             ])
         
+        if columnar:
+            fechas, promedios, cantidades = zip(*datos)
+            logger.info(f"Enviando {len(datos)} puntos de datos para {parametro}")
+            return jsonify({
+                'fecha': fechas,
+                'valor': [round(promedio, 2) for promedio in promedios],
+                'cantidad': cantidades
+            })
+        
         # Convertir a formato esperado por el frontend
         resultado = [
             {
@@ -401,9 +597,84 @@ def datos_grafico_parametro(parametro):
         logger.error(f"Error al obtener datos de gráfico para {parametro}: {e}")
         return jsonify({'error': 'Error interno del servidor'}), 500
 
+# Máximo de meses que se pueden pedir a la tendencia (20 años)
+MESES_TENDENCIA_MAX = 240
+
+@app.route('/api/datos/tendencia/<parametro>')
+def tendencia_parametro(parametro):
+    """
+    Tendencia mensual de largo plazo de un parámetro (?meses=24 por defecto,
+    entre 1 y MESES_TENDENCIA_MAX).
+    Combina los resúmenes horarios de la retención con las mediciones crudas recientes.
+    """
+    try:
+        meses = request.args.get('meses', 24, type=int)
+        if not 1 <= meses <= MESES_TENDENCIA_MAX:
+            return jsonify({'error': f'meses debe estar entre 1 y {MESES_TENDENCIA_MAX}'}), 400
+        desde = (datetime.now() - timedelta(days=31 * meses)).strftime('%Y-%m-01 00:00:00')
+        
+        conn = db.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            SELECT mes, SUM(cantidad), SUM(suma) / SUM(cantidad), MIN(minimo), MAX(maximo)
+            FROM (
+                SELECT strftime('%Y-%m', r.periodo) AS mes, r.cantidad, r.suma,
+                       r.minimo, r.maximo
+                FROM mediciones_resumen r
+                WHERE r.id_parametro IN (
+                    SELECT id_parametro FROM parametros_ambientales
+                    WHERE nombre_parametro LIKE ?
+                ) AND r.periodo >= ?
+                
+                UNION ALL
+                
+                SELECT strftime('%Y-%m', m.fecha_medicion), COUNT(*), SUM(m.valor_medido),
+                       MIN(m.valor_medido), MAX(m.valor_medido)
+                FROM mediciones m
+                JOIN parametros_ambientales p ON m.id_parametro = p.id_parametro
+                WHERE p.nombre_parametro LIKE ? AND m.fecha_medicion >= ?
+                  AND m.valor_medido IS NOT NULL
+                GROUP BY strftime('%Y-%m', m.fecha_medicion)
+            )
+            GROUP BY mes
+            ORDER BY mes ASC
+        ''', (f'%{parametro}%', desde, f'%{parametro}%', desde))
+        
+        datos = cursor.fetchall()
+        conn.close()
+        
+        resultado = [
+            {
+                'mes': fila[0],
+                'cantidad': fila[1],
+                'promedio': round(fila[2], 2),
+                'minimo': fila[3],
+                'maximo': fila[4]
+            }
+            for fila in datos
+        ]
+        
+        logger.info(f"Enviando tendencia de {len(resultado)} meses para {parametro}")
+        return jsonify(resultado)
+        
+    except Exception as e:
+        logger.error(f"Error al obtener tendencia para {parametro}: {e}")
+        return jsonify({'error': 'Error interno del servidor'}), 500
+
 @app.route('/api/monitoreo', methods=['POST'])
 def api_agregar_monitoreo():
-    """Recibe datos de monitoreo desde dispositivos externos (JSON)"""
+    """
+    Recibe datos de monitoreo desde dispositivos externos (JSON).
+    Los dispositivos que reintentan pueden enviar una clave de idempotencia
+    (cabecera Idempotency-Key o campo 'clave_idempotencia') o bien
+    'id_dispositivo' junto con 'timestamp' (hora de la lectura): un reenvío
+    ya guardado no inserta filas nuevas. Sin identificar al dispositivo, dos
+    lecturas con la misma hora se guardan ambas.
+    Con 'latitud' y 'longitud' la lectura se asigna a la estación activa más
+    cercana a menos de RADIO_ESTACION_KM; si no hay ninguna se rechaza, salvo
+    que se envíe 'crear_estacion': true para registrar una estación en ese punto.
+    """
     try:
         # Verificar que se recibió JSON
         if not request.is_json:
@@ -420,34 +691,60 @@ def api_agregar_monitoreo():
                 'message': 'No se recibieron datos válidos'
             }), 400
         
+        try:
+            fecha_dispositivo = (validar_timestamp(data['timestamp'])
+                                 if data.get('timestamp') not in (None, '') else None)
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+        fecha_medicion = (fecha_dispositivo[:19] if fecha_dispositivo
+                          else datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+        clave = request.headers.get('Idempotency-Key') or data.get('clave_idempotencia') or None
+        dispositivo = str(data.get('id_dispositivo') or '').strip() or None
+        
+        coordenadas = None
+        if data.get('latitud') is not None or data.get('longitud') is not None:
+            try:
+                coordenadas = validar_coordenadas(data.get('latitud'), data.get('longitud'))
+            except ValueError as e:
+                return jsonify({'success': False, 'message': str(e)}), 400
+        
         conn = db.get_connection()
         cursor = conn.cursor()
         
-        # Obtener o crear estación por defecto
-        cursor.execute("""
-            SELECT id_estacion FROM estaciones_monitoreo 
-            WHERE estado = 'activa' 
-            ORDER BY id_estacion 
-            LIMIT 1
-        """)
-        estacion_result = cursor.fetchone()
+        # Reintento de un envío ya guardado: se responde sin volver a procesarlo
+        if clave is not None:
+            cursor.execute(
+                "SELECT COUNT(*) FROM mediciones WHERE clave_idempotencia = ?", (str(clave),)
+            )
+            ya_guardadas = cursor.fetchone()[0]
+            if ya_guardadas:
+                conn.close()
+                return jsonify({
+                    'success': True,
+                    'message': 'Envío ya registrado anteriormente',
+                    'duplicado': True,
+                    'mediciones_procesadas': 0,
+                    'mediciones_guardadas': 0,
+                    'mediciones_duplicadas': ya_guardadas
+                })
         
-        if not estacion_result:
-            # Crear estación por defecto
-            cursor.execute('''
-                INSERT INTO estaciones_monitoreo (nombre_estacion, ubicacion, estado)
-                VALUES (?, ?, ?)
-            ''', ('Estación API', 'Remoto', 'activa'))
-            estacion_id = cursor.lastrowid
-            logger.info(f"Creada nueva estación con ID: {estacion_id}")
+        if coordenadas:
+            estacion_id = resolver_estacion(cursor, *coordenadas, crear=data.get('crear_estacion') is True)
+            if estacion_id is None:
+                conn.close()
+                return jsonify({
+                    'success': False,
+                    'message': f'No hay estaciones activas a menos de {RADIO_ESTACION_KM:g} km '
+                               f'de ({coordenadas[0]}, {coordenadas[1]})'
+                }), 422
         else:
-            estacion_id = estacion_result[0]
+            estacion_id = obtener_estacion_por_defecto(cursor)
         
-        mediciones_guardadas = 0
+        filas = []
         
         # Procesar cada parámetro recibido
         for parametro, valor in data.items():
-            if parametro in ['observaciones', 'timestamp']:
+            if parametro in CAMPOS_NO_MEDIDOS:
                 continue  # Saltar campos no numéricos
             
             try:
@@ -466,8 +763,8 @@ def api_agregar_monitoreo():
             
             if not param_result:
                 # Crear nuevo parámetro
-                unidad = self._obtener_unidad_por_parametro(parametro)
-                limite = self._obtener_limite_por_parametro(parametro)
+                unidad = _obtener_unidad_por_parametro(parametro)
+                limite = _obtener_limite_por_parametro(parametro)
                 
                 cursor.execute('''
                     INSERT INTO parametros_ambientales 
@@ -479,31 +776,44 @@ def api_agregar_monitoreo():
             else:
                 param_id = param_result[0]
             
-            # Insertar medición
-            cursor.execute('''
-                INSERT INTO mediciones 
-                (id_estacion, id_parametro, valor_medido, fecha_medicion, 
-                 responsable_medicion, observaciones)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (
+            filas.append((
                 estacion_id,
                 param_id,
                 valor_numerico,
-                datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                fecha_medicion,
+                fecha_dispositivo,
+                dispositivo,
+                None if clave is None else str(clave),
                 'Sistema Automático',
                 data.get('observaciones', '')
             ))
-            
-            mediciones_guardadas += 1
-            logger.info(f"Guardado {parametro}: {valor_numerico}")
+        
+        # Un solo INSERT por lote; las lecturas repetidas chocan con los índices
+        # únicos y se descartan sin error
+        cursor.executemany('''
+            INSERT INTO mediciones 
+            (id_estacion, id_parametro, valor_medido, fecha_medicion, fecha_dispositivo,
+             id_dispositivo, clave_idempotencia, responsable_medicion, observaciones)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT DO NOTHING
+        ''', filas)
+        mediciones_guardadas = max(cursor.rowcount, 0)
+        mediciones_duplicadas = len(filas) - mediciones_guardadas
         
         conn.commit()
         conn.close()
+        if mediciones_guardadas:
+            sincronizar_snapshot()
+        if mediciones_duplicadas:
+            logger.info(f"Descartadas {mediciones_duplicadas} mediciones repetidas")
         
         return jsonify({
             'success': True, 
             'message': f'{mediciones_guardadas} mediciones guardadas correctamente',
-            'mediciones_procesadas': mediciones_guardadas
+            'id_estacion': estacion_id,
+            'mediciones_procesadas': len(filas),
+            'mediciones_guardadas': mediciones_guardadas,
+            'mediciones_duplicadas': mediciones_duplicadas
         })
         
     except Exception as e:
@@ -513,7 +823,33 @@ def api_agregar_monitoreo():
             'message': f'Error interno: {str(e)}'
         }), 500
 
-def _obtener_unidad_por_parametro(self, parametro):
+# Campos del JSON de /api/monitoreo que no son parámetros medidos
+CAMPOS_NO_MEDIDOS = {
+    'observaciones', 'timestamp', 'clave_idempotencia', 'id_dispositivo',
+    'latitud', 'longitud', 'crear_estacion'
+}
+
+def obtener_estacion_por_defecto(cursor):
+    """Primera estación activa; si no hay ninguna, crea una estación por defecto"""
+    cursor.execute("""
+        SELECT id_estacion FROM estaciones_monitoreo 
+        WHERE estado = 'activa' 
+        ORDER BY id_estacion 
+        LIMIT 1
+    """)
+    estacion_result = cursor.fetchone()
+    
+    if estacion_result:
+        return estacion_result[0]
+    
+    cursor.execute('''
+        INSERT INTO estaciones_monitoreo (nombre_estacion, tipo_estacion, estado)
+        VALUES (?, ?, ?)
+    ''', ('Estación API', 'Remoto', 'activa'))
+    logger.info(f"Creada nueva estación con ID: {cursor.lastrowid}")
+    return cursor.lastrowid
+
+def _obtener_unidad_por_parametro(parametro):
     """Determina la unidad de medida según el parámetro"""
     parametro_lower = parametro.lower()
     if 'temperatura' in parametro_lower:
@@ -529,7 +865,7 @@ def _obtener_unidad_por_parametro(self, parametro):
     else:
         return 'unidad'
 
-def _obtener_limite_por_parametro(self, parametro):
+def _obtener_limite_por_parametro(parametro):
     """Determina el límite permisible según el parámetro"""
     parametro_lower = parametro.lower()
     if 'temperatura' in parametro_lower:
@@ -541,27 +877,807 @@ def _obtener_limite_por_parametro(self, parametro):
     else:
         return 100.0
 
+# ==================== ESTACIONES Y MAPA ====================
+
+# Distancia máxima para asignar una lectura geolocalizada a una estación existente
+RADIO_ESTACION_KM = float(os.environ.get('RADIO_ESTACION_KM', 5))
+
+def validar_coordenadas(latitud, longitud):
+    """Valida latitud (-90 a 90) y longitud (-180 a 180) en grados"""
+    try:
+        latitud, longitud = float(latitud), float(longitud)
+    except (ValueError, TypeError):
+        raise ValueError("latitud y longitud deben ser números válidos")
+    if not -90 <= latitud <= 90:
+        raise ValueError("latitud debe estar entre -90 y 90")
+    if not -180 <= longitud <= 180:
+        raise ValueError("longitud debe estar entre -180 y 180")
+    return latitud, longitud
+
+def validar_radio(valor):
+    """Valida un radio de búsqueda en km (número positivo)"""
+    try:
+        radio = float(valor)
+    except (ValueError, TypeError):
+        raise ValueError("radio_km debe ser un número positivo")
+    if not radio > 0 or radio == float('inf'):
+        raise ValueError("radio_km debe ser un número positivo")
+    return radio
+
+def obtener_indice_estaciones():
+    """
+    Estaciones en memoria con sus índices espaciales (todas y solo activas).
+    Se guarda en caché hasta que cambie la tabla de estaciones.
+    """
+    def calcular():
+        conn = db.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT id_estacion, nombre_estacion, latitud, longitud, tipo_estacion, estado
+            FROM estaciones_monitoreo
+        ''')
+        columnas = [d[0] for d in cursor.description]
+        estaciones = [dict(zip(columnas, fila)) for fila in cursor.fetchall()]
+        conn.close()
+
+        ubicadas = [e for e in estaciones if e['latitud'] is not None and e['longitud'] is not None]
+        activas = [e for e in ubicadas if e['estado'] == 'activa']
+
+        def indexar(filas):
+            return IndiceEstaciones(
+                [e['id_estacion'] for e in filas],
+                [e['latitud'] for e in filas],
+                [e['longitud'] for e in filas]
+            )
+
+        return {
+            'estaciones': {e['id_estacion']: e for e in estaciones},
+            'todas': indexar(ubicadas),
+            'activas': indexar(activas)
+        }
+
+    return obtener_con_cache('indice_estaciones', ('estaciones_monitoreo',), calcular)
+
+def resolver_estacion(cursor, latitud, longitud, crear=False):
+    """
+    Estación activa más cercana a una lectura geolocalizada
+    Args:
+        cursor: Cursor de la transacción en curso
+        latitud, longitud: Coordenadas de la lectura
+        crear: Si ninguna estación está a menos de RADIO_ESTACION_KM, registrar
+            una nueva en ese punto (solo a pedido del emisor: un sensor móvil
+            crearía una estación cada pocos kilómetros)
+    Returns:
+        int: id_estacion, o None si no hay ninguna en el radio y crear es False
+    """
+    cercana = obtener_indice_estaciones()['activas'].mas_cercana(
+        latitud, longitud, radio_km=RADIO_ESTACION_KM
+    )
+    if cercana:
+        return cercana[0]
+    if not crear:
+        return None
+
+    cursor.execute('''
+        INSERT INTO estaciones_monitoreo (nombre_estacion, latitud, longitud, tipo_estacion, estado)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (f'Estación API ({latitud:.4f}, {longitud:.4f})', latitud, longitud, 'Remoto', 'activa'))
+    logger.info(f"Creada nueva estación con ID: {cursor.lastrowid} en ({latitud}, {longitud})")
+    return cursor.lastrowid
+
+@app.route('/api/estaciones/cercana')
+def api_estacion_cercana():
+    """Estación más cercana a ?latitud=&longitud= (opcional: radio_km y activas=1)"""
+    try:
+        try:
+            latitud, longitud = validar_coordenadas(
+                request.args.get('latitud'), request.args.get('longitud')
+            )
+            radio_km = request.args.get('radio_km')
+            radio_km = None if radio_km is None else validar_radio(radio_km)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        indice = obtener_indice_estaciones()
+        tipo_indice = 'activas' if request.args.get('activas') == '1' else 'todas'
+        cercana = indice[tipo_indice].mas_cercana(latitud, longitud, radio_km=radio_km)
+        if not cercana:
+            return jsonify({'error': 'No hay estaciones en el radio indicado'}), 404
+
+        id_estacion, distancia = cercana
+        return jsonify(dict(indice['estaciones'][id_estacion], distancia_km=round(distancia, 3)))
+
+    except Exception as e:
+        logger.error(f"Error al buscar estación cercana: {e}")
+        return jsonify({'error': 'Error interno del servidor'}), 500
+
+@app.route('/api/estaciones/mapa')
+def api_estaciones_mapa():
+    """
+    Estaciones dentro del área visible del mapa con el último valor de cada
+    parámetro. Parámetros: lat_min, lon_min, lat_max, lon_max (si lon_min >
+    lon_max el área cruza el antimeridiano).
+    """
+    try:
+        try:
+            lat_min, lon_min = validar_coordenadas(request.args.get('lat_min'), request.args.get('lon_min'))
+            lat_max, lon_max = validar_coordenadas(request.args.get('lat_max'), request.args.get('lon_max'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if lat_min > lat_max:
+            return jsonify({'error': 'lat_min debe ser menor o igual que lat_max'}), 400
+
+        indice = obtener_indice_estaciones()
+        ids = indice['todas'].en_rectangulo(lat_min, lon_min, lat_max, lon_max)
+
+        estaciones = {}
+        for id_estacion in ids.tolist():
+            estaciones[id_estacion] = dict(indice['estaciones'][id_estacion], ultimos={})
+
+        if estaciones:
+            db.update_latest_measurements()
+            conn = db.get_connection()
+            cursor = conn.cursor()
+            # json_each evita armar un IN (?, ?, ...) con miles de parámetros
+            cursor.execute('''
+                SELECT u.id_estacion, p.nombre_parametro, u.valor_medido, p.unidad_medida,
+                       p.valor_limite_permisible, u.fecha_medicion
+                FROM ultimas_mediciones u
+                JOIN parametros_ambientales p ON u.id_parametro = p.id_parametro
+                WHERE u.id_estacion IN (SELECT value FROM json_each(?))
+            ''', (json.dumps(list(estaciones)),))
+            ultimas = cursor.fetchall()
+            conn.close()
+
+            for id_estacion, parametro, valor, unidad, limite, fecha in ultimas:
+                estaciones[id_estacion]['ultimos'][parametro] = {
+                    'valor': valor,
+                    'unidad': unidad,
+                    'fecha': fecha,
+                    'excede_limite': limite is not None and valor > limite
+                }
+
+        return jsonify({'total': len(estaciones), 'estaciones': list(estaciones.values())})
+
+    except Exception as e:
+        logger.error(f"Error al obtener estaciones del mapa: {e}")
+        return jsonify({'error': 'Error interno del servidor'}), 500
+
+# ==================== ACTIVIDADES PESQUERAS ====================
+
+CAMPOS_ACTIVIDAD = [
+    'tipo_actividad', 'embarcacion', 'tonelaje_procesado', 'fecha_actividad',
+    'hora_inicio', 'hora_fin', 'zona_puerto'
+]
+
+def validar_hora(valor, nombre_campo):
+    """Valida una hora HH:MM o HH:MM:SS y la normaliza a HH:MM:SS"""
+    for formato in ('%H:%M:%S', '%H:%M'):
+        try:
+            return datetime.strptime(str(valor), formato).strftime('%H:%M:%S')
+        except ValueError:
+            continue
+    raise ValueError(f"{nombre_campo} debe tener formato HH:MM o HH:MM:SS")
+
+def validar_actividad(data):
+    """
+    Valida una actividad pesquera recibida como JSON
+    Args:
+        data: Diccionario con los campos de la actividad
+    Returns:
+        tuple: Valores en el orden de CAMPOS_ACTIVIDAD
+    Raises:
+        ValueError: Si falta un campo o tiene un formato inválido
+    """
+    for campo in ['tipo_actividad', 'fecha_actividad', 'hora_inicio', 'hora_fin']:
+        if not data.get(campo):
+            raise ValueError(f'El campo {campo} es obligatorio')
+    
+    try:
+        fecha = datetime.strptime(str(data['fecha_actividad']), '%Y-%m-%d').strftime('%Y-%m-%d')
+    except ValueError:
+        raise ValueError("fecha_actividad debe tener formato YYYY-MM-DD")
+    
+    tonelaje = data.get('tonelaje_procesado')
+    if tonelaje not in (None, ''):
+        try:
+            tonelaje = float(tonelaje)
+        except (ValueError, TypeError):
+            raise ValueError("tonelaje_procesado debe ser un número válido")
+        if tonelaje < 0:
+            raise ValueError("tonelaje_procesado no puede ser negativo")
+    else:
+        tonelaje = None
+    
+    hora_inicio = validar_hora(data['hora_inicio'], 'hora_inicio')
+    hora_fin = validar_hora(data['hora_fin'], 'hora_fin')
+    if hora_fin == hora_inicio:
+        raise ValueError("hora_fin debe ser distinta de hora_inicio")
+    
+    return (
+        str(data['tipo_actividad']).strip(),
+        str(data.get('embarcacion') or '').strip(),
+        tonelaje,
+        fecha,
+        hora_inicio,
+        hora_fin,
+        str(data.get('zona_puerto') or '').strip()
+    )
+
+def actividad_a_dict(fila):
+    """Convierte una fila de actividades_pesqueras en diccionario"""
+    return dict(zip(['id_actividad'] + CAMPOS_ACTIVIDAD, fila))
+
+@app.route('/api/actividades', methods=['GET'])
+def listar_actividades():
+    """Lista actividades pesqueras, filtrando opcionalmente por ?desde=, ?hasta= y ?tipo="""
+    try:
+        condiciones = []
+        parametros = []
+        if request.args.get('desde'):
+            condiciones.append("fecha_actividad >= ?")
+            parametros.append(request.args['desde'])
+        if request.args.get('hasta'):
+            condiciones.append("fecha_actividad <= ?")
+            parametros.append(request.args['hasta'])
+        if request.args.get('tipo'):
+            condiciones.append("tipo_actividad = ?")
+            parametros.append(request.args['tipo'])
+        
+        where = f"WHERE {' AND '.join(condiciones)}" if condiciones else ""
+        
+        conn = db.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT id_actividad, {', '.join(CAMPOS_ACTIVIDAD)}
+            FROM actividades_pesqueras
+            {where}
+            ORDER BY fecha_actividad DESC, hora_inicio DESC
+        ''', parametros)
+        actividades = cursor.fetchall()
+        conn.close()
+        
+        return jsonify([actividad_a_dict(fila) for fila in actividades])
+    
+    except Exception as e:
+        logger.error(f"Error al listar actividades: {e}")
+        return jsonify({'error': 'Error interno del servidor'}), 500
+
+@app.route('/api/actividades', methods=['POST'])
+def agregar_actividades():
+    """Registra una actividad pesquera o una lista de actividades (ingesta por lotes)"""
+    try:
+        if not request.is_json:
+            return jsonify({'success': False, 'message': 'Contenido debe ser JSON'}), 400
+        
+        data = request.get_json()
+        actividades = data if isinstance(data, list) else [data]
+        
+        # Se valida todo el lote antes de insertar para no dejar cargas a medias
+        try:
+            filas = [validar_actividad(actividad or {}) for actividad in actividades]
+        except (ValueError, AttributeError) as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+        
+        conn = db.get_connection()
+        cursor = conn.cursor()
+        cursor.executemany(f'''
+            INSERT INTO actividades_pesqueras ({', '.join(CAMPOS_ACTIVIDAD)})
+            VALUES ({', '.join('?' * len(CAMPOS_ACTIVIDAD))})
+        ''', filas)
+        conn.commit()
+        conn.close()
+        
+        logger.info(f"Registradas {len(filas)} actividades pesqueras")
+        return jsonify({
+            'success': True,
+            'message': f'{len(filas)} actividades registradas correctamente',
+            'actividades_procesadas': len(filas)
+        })
+    
+    except Exception as e:
+        logger.error(f"Error al registrar actividades: {e}")
+        return jsonify({'success': False, 'message': f'Error interno: {str(e)}'}), 500
+
+@app.route('/api/actividades/<int:id_actividad>', methods=['PUT'])
+def actualizar_actividad(id_actividad):
+    """Reemplaza los datos de una actividad pesquera"""
+    try:
+        if not request.is_json:
+            return jsonify({'success': False, 'message': 'Contenido debe ser JSON'}), 400
+        
+        try:
+            fila = validar_actividad(request.get_json() or {})
+        except (ValueError, AttributeError) as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+        
+        conn = db.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            UPDATE actividades_pesqueras
+            SET {', '.join(f'{campo} = ?' for campo in CAMPOS_ACTIVIDAD)}
+            WHERE id_actividad = ?
+        ''', fila + (id_actividad,))
+        conn.commit()
+        actualizadas = cursor.rowcount
+        conn.close()
+        
+        if not actualizadas:
+            return jsonify({'success': False, 'message': 'Actividad no encontrada'}), 404
+        
+        return jsonify({'success': True, 'message': 'Actividad actualizada correctamente'})
+    
+    except Exception as e:
+        logger.error(f"Error al actualizar actividad {id_actividad}: {e}")
+        return jsonify({'success': False, 'message': f'Error interno: {str(e)}'}), 500
+
+@app.route('/api/actividades/<int:id_actividad>', methods=['DELETE'])
+def eliminar_actividad(id_actividad):
+    """Elimina una actividad pesquera"""
+    try:
+        conn = db.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM actividades_pesqueras WHERE id_actividad = ?", (id_actividad,))
+        conn.commit()
+        eliminadas = cursor.rowcount
+        conn.close()
+        
+        if not eliminadas:
+            return jsonify({'success': False, 'message': 'Actividad no encontrada'}), 404
+        
+        return jsonify({'success': True, 'message': 'Actividad eliminada correctamente'})
+    
+    except Exception as e:
+        logger.error(f"Error al eliminar actividad {id_actividad}: {e}")
+        return jsonify({'success': False, 'message': f'Error interno: {str(e)}'}), 500
+
+@app.route('/api/actividades/analisis')
+def analisis_actividades():
+    """
+    Compara cada parámetro durante las actividades pesqueras frente a los
+    periodos sin actividad, por tipo de actividad y estación.
+    Query params opcionales: desde, hasta (YYYY-MM-DD) y parametro (nombre, LIKE).
+    Las actividades se consideran de todo el puerto: zona_puerto no está
+    vinculada a las estaciones de monitoreo.
+    """
+    try:
+        desde = request.args.get('desde')
+        hasta = request.args.get('hasta')
+        try:
+            inicio_rango = datetime.strptime(desde, '%Y-%m-%d') if desde else None
+            fin_rango = datetime.strptime(hasta, '%Y-%m-%d') + timedelta(days=1) if hasta else None
+        except ValueError:
+            return jsonify({'error': 'desde y hasta deben tener formato YYYY-MM-DD'}), 400
+        
+        conn = db.get_connection()
+        cursor = conn.cursor()
+        
+        # Intervalos en segundos epoch; si hora_fin < hora_inicio la actividad cruza la medianoche.
+        # Las actividades de duración cero (registradas antes de validarlas) se ignoran.
+        cursor.execute('''
+            SELECT tipo_actividad,
+                   CAST(strftime('%s', fecha_actividad || ' ' || hora_inicio) AS INTEGER) AS inicio,
+                   CAST(strftime('%s', fecha_actividad || ' ' || hora_fin) AS INTEGER)
+                   + CASE WHEN time(hora_fin) < time(hora_inicio) THEN 86400 ELSE 0 END AS fin
+            FROM actividades_pesqueras
+            WHERE tipo_actividad IS NOT NULL
+              AND fecha_actividad IS NOT NULL
+              AND hora_inicio IS NOT NULL
+              AND hora_fin IS NOT NULL
+              AND time(hora_fin) IS NOT time(hora_inicio)
+        ''')
+        intervalos_por_tipo = {}
+        for tipo, inicio, fin in cursor.fetchall():
+            if inicio is None or fin is None:
+                continue
+            inicios, fines = intervalos_por_tipo.setdefault(tipo, ([], []))
+            inicios.append(inicio)
+            fines.append(fin)
+        
+        if request.args.get('parametro'):
+            cursor.execute('''
+                SELECT id_parametro, nombre_parametro FROM parametros_ambientales
+                WHERE nombre_parametro LIKE ?
+            ''', (f"%{request.args['parametro']}%",))
+        else:
+            cursor.execute("SELECT id_parametro, nombre_parametro FROM parametros_ambientales")
+        parametros = cursor.fetchall()
+        
+        cursor.execute("SELECT id_estacion, nombre_estacion FROM estaciones_monitoreo")
+        nombres_estaciones = dict(cursor.fetchall())
+        conn.close()
+        
+        sincronizar_snapshot()
+        
+        # {tipo: {parametro: {estacion: comparación}}}
+        resultado = {tipo: {} for tipo in intervalos_por_tipo}
+        for id_parametro, nombre_parametro in parametros:
+            tiempos, valores, estaciones = snapshot.read(id_parametro)
+            if inicio_rango or fin_rango:
+                mascara = np.ones(len(tiempos), dtype=bool)
+                if inicio_rango:
+                    mascara &= tiempos >= segundos_epoch(inicio_rango)
+                if fin_rango:
+                    mascara &= tiempos < segundos_epoch(fin_rango)
+                tiempos, valores, estaciones = tiempos[mascara], valores[mascara], estaciones[mascara]
+            
+            comparacion = comparar_actividad_inactividad(tiempos, valores, estaciones, intervalos_por_tipo)
+            for tipo, por_estacion in comparacion.items():
+                if por_estacion:
+                    resultado[tipo][nombre_parametro] = {
+                        nombres_estaciones.get(id_estacion, f'Estación {id_estacion}'): datos
+                        for id_estacion, datos in por_estacion.items()
+                    }
+        
+        logger.info(f"Análisis de {len(intervalos_por_tipo)} tipos de actividad y {len(parametros)} parámetros")
+        return jsonify(resultado)
+    
+    except Exception as e:
+        logger.error(f"Error en análisis de actividades: {e}")
+        return jsonify({'error': 'Error interno del servidor'}), 500
+
+# ==================== ASPECTOS E IMPACTOS AMBIENTALES ====================
+
+CAMPOS_ASPECTO = [
+    'nombre_aspecto', 'descripcion', 'tipo_aspecto', 'fuente_generadora', 'frecuencia', 'magnitud'
+]
+
+CAMPOS_IMPACTO = [
+    'id_aspecto', 'descripcion_impacto', 'componente_afectado', 'tipo_impacto',
+    'magnitud', 'importancia', 'reversibilidad', 'duracion'
+]
+
+def validar_escala(valor, nombre_campo):
+    """Valida un valor entero de 1 a 10 (magnitud e importancia)"""
+    try:
+        numero = int(valor)
+    except (ValueError, TypeError):
+        raise ValueError(f"{nombre_campo} debe ser un entero de 1 a 10")
+    if numero < 1 or numero > 10:
+        raise ValueError(f"{nombre_campo} debe ser un entero de 1 a 10")
+    return numero
+
+def validar_aspecto(data):
+    """Valida un aspecto ambiental y devuelve sus valores en el orden de CAMPOS_ASPECTO"""
+    if not data.get('nombre_aspecto'):
+        raise ValueError('El campo nombre_aspecto es obligatorio')
+    return tuple(str(data.get(campo) or '').strip() for campo in CAMPOS_ASPECTO)
+
+def validar_impacto(data, ids_aspectos):
+    """Valida un impacto ambiental y devuelve sus valores en el orden de CAMPOS_IMPACTO"""
+    for campo in ['id_aspecto', 'componente_afectado', 'magnitud', 'importancia']:
+        if data.get(campo) in (None, ''):
+            raise ValueError(f'El campo {campo} es obligatorio')
+    
+    try:
+        id_aspecto = int(data['id_aspecto'])
+    except (ValueError, TypeError):
+        raise ValueError("id_aspecto debe ser un entero")
+    if id_aspecto not in ids_aspectos:
+        raise ValueError(f"El aspecto {id_aspecto} no existe")
+    
+    tipo = str(data.get('tipo_impacto') or 'negativo').strip().lower()
+    if tipo not in ('positivo', 'negativo'):
+        raise ValueError("tipo_impacto debe ser 'positivo' o 'negativo'")
+    
+    return (
+        id_aspecto,
+        str(data.get('descripcion_impacto') or '').strip(),
+        str(data['componente_afectado']).strip(),
+        tipo,
+        validar_escala(data['magnitud'], 'magnitud'),
+        validar_escala(data['importancia'], 'importancia'),
+        str(data.get('reversibilidad') or '').strip(),
+        str(data.get('duracion') or '').strip()
+    )
+
+def evaluar_impactos():
+    """
+    Calcula la significancia de todos los impactos y la matriz aspectos x componentes.
+    Se guarda en caché hasta que cambien las tablas de aspectos o impactos.
+    """
+    def calcular():
+        conn = db.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT id_aspecto, nombre_aspecto FROM aspectos_ambientales")
+        nombres_aspectos = dict(cursor.fetchall())
+        cursor.execute(f'''
+            SELECT id_impacto, {', '.join(CAMPOS_IMPACTO)}
+            FROM impactos_ambientales
+            ORDER BY id_impacto
+        ''')
+        impactos = cursor.fetchall()
+        conn.close()
+        
+        if impactos:
+            (ids, ids_aspectos, descripciones, componentes, tipos,
+             magnitudes, importancias, reversibilidades, duraciones) = zip(*impactos)
+        else:
+            ids = ids_aspectos = descripciones = componentes = tipos = ()
+            magnitudes = importancias = reversibilidades = duraciones = ()
+        
+        ids_aspectos = np.array(ids_aspectos, dtype=float)
+        ids_aspectos = np.where(np.isnan(ids_aspectos), -1, ids_aspectos).astype(np.int64)
+        codigos, componentes = factorizar_componentes(componentes)
+        significancia, niveles = calcular_significancia(
+            magnitudes, importancias, reversibilidades, duraciones, tipos
+        )
+        filas, suma, cantidad = matriz_aspecto_componente(
+            ids_aspectos, codigos, componentes, significancia
+        )
+        
+        return {
+            # Columnas por impacto: la lista de diccionarios se arma solo en /api/impactos
+            'columnas': {
+                'id_impacto': ids,
+                'id_aspecto': ids_aspectos,
+                'descripcion_impacto': descripciones,
+                'componente_afectado': componentes[codigos] if len(ids) else [],
+                'tipo_impacto': tipos,
+                'significancia': significancia,
+                'nivel': niveles
+            },
+            'aspectos': [
+                {'id_aspecto': int(a), 'nombre_aspecto': nombres_aspectos.get(int(a), 'Sin aspecto')}
+                for a in filas
+            ],
+            'componentes': [str(c) for c in componentes],
+            'suma': suma,
+            'cantidad': cantidad
+        }
+    
+    return obtener_con_cache(
+        'evaluacion_impactos',
+        ('aspectos_ambientales', 'impactos_ambientales'),
+        calcular
+    )
+
+def excedencia_por_componente(dias=30):
+    """
+    Fracción de mediciones sobre el límite en los últimos días, por tipo_matriz
+    del parámetro (agua, aire...), que se compara con componente_afectado.
+    """
+    def calcular():
+        conn = db.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT id_parametro, nombre_parametro, valor_limite_permisible, tipo_matriz
+            FROM parametros_ambientales
+        ''')
+        parametros = cursor.fetchall()
+        conn.close()
+        
+        sincronizar_snapshot()
+        desde = segundos_epoch(datetime.now() - timedelta(days=dias))
+        
+        por_componente = {}
+        for id_parametro, nombre, limite, matriz in parametros:
+            tiempos, valores, _ = snapshot.read(id_parametro)
+            recientes = valores[tiempos >= desde]
+            if limite is None or recientes.size == 0:
+                continue
+            excedencias = int(np.count_nonzero(recientes > limite))
+            componente = por_componente.setdefault((matriz or '').strip().lower(), {
+                'excedencias': 0, 'mediciones': 0, 'parametros': {}
+            })
+            componente['excedencias'] += excedencias
+            componente['mediciones'] += int(recientes.size)
+            componente['parametros'][nombre] = round(excedencias / recientes.size, 4)
+        
+        return {
+            matriz: {
+                'tasa': round(datos['excedencias'] / datos['mediciones'], 4),
+                'mediciones': datos['mediciones'],
+                'parametros': datos['parametros']
+            }
+            for matriz, datos in por_componente.items()
+        }
+    
+    return obtener_con_cache(
+        f'excedencia:{dias}',
+        ('mediciones', 'parametros_ambientales'),
+        calcular,
+        extra=(datetime.now().date(),)
+    )
+
+@app.route('/api/aspectos', methods=['GET'])
+def listar_aspectos():
+    """Lista los aspectos ambientales registrados"""
+    try:
+        conn = db.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT id_aspecto, {', '.join(CAMPOS_ASPECTO)}
+            FROM aspectos_ambientales
+            ORDER BY id_aspecto
+        ''')
+        aspectos = cursor.fetchall()
+        conn.close()
+        
+        return jsonify([dict(zip(['id_aspecto'] + CAMPOS_ASPECTO, fila)) for fila in aspectos])
+    
+    except Exception as e:
+        logger.error(f"Error al listar aspectos: {e}")
+        return jsonify({'error': 'Error interno del servidor'}), 500
+
+@app.route('/api/aspectos', methods=['POST'])
+def agregar_aspectos():
+    """Registra un aspecto ambiental o una lista de aspectos"""
+    try:
+        if not request.is_json:
+            return jsonify({'success': False, 'message': 'Contenido debe ser JSON'}), 400
+        
+        data = request.get_json()
+        aspectos = data if isinstance(data, list) else [data]
+        
+        try:
+            filas = [validar_aspecto(aspecto or {}) for aspecto in aspectos]
+        except (ValueError, AttributeError) as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+        
+        conn = db.get_connection()
+        cursor = conn.cursor()
+        cursor.executemany(f'''
+            INSERT INTO aspectos_ambientales ({', '.join(CAMPOS_ASPECTO)})
+            VALUES ({', '.join('?' * len(CAMPOS_ASPECTO))})
+        ''', filas)
+        conn.commit()
+        conn.close()
+        
+        return jsonify({
+            'success': True,
+            'message': f'{len(filas)} aspectos registrados correctamente',
+            'aspectos_procesados': len(filas)
+        })
+    
+    except Exception as e:
+        logger.error(f"Error al registrar aspectos: {e}")
+        return jsonify({'success': False, 'message': f'Error interno: {str(e)}'}), 500
+
+@app.route('/api/impactos', methods=['GET'])
+def listar_impactos():
+    """Lista los impactos con su significancia (0-100, negativa si el impacto es negativo) y nivel"""
+    try:
+        columnas = evaluar_impactos()['columnas']
+        significancia = [None if np.isnan(v) else float(v) for v in columnas['significancia']]
+        impactos = [
+            {
+                'id_impacto': id_impacto,
+                'id_aspecto': int(id_aspecto),
+                'descripcion_impacto': descripcion,
+                'componente_afectado': str(componente),
+                'tipo_impacto': tipo,
+                'significancia': valor,
+                'nivel': str(nivel)
+            }
+            for id_impacto, id_aspecto, descripcion, componente, tipo, valor, nivel in zip(
+                columnas['id_impacto'], columnas['id_aspecto'], columnas['descripcion_impacto'],
+                columnas['componente_afectado'], columnas['tipo_impacto'], significancia,
+                columnas['nivel']
+            )
+        ]
+        return jsonify(impactos)
+    except Exception as e:
+        logger.error(f"Error al listar impactos: {e}")
+        return jsonify({'error': 'Error interno del servidor'}), 500
+
+@app.route('/api/impactos', methods=['POST'])
+def agregar_impactos():
+    """Registra un impacto ambiental o una lista de impactos"""
+    try:
+        if not request.is_json:
+            return jsonify({'success': False, 'message': 'Contenido debe ser JSON'}), 400
+        
+        data = request.get_json()
+        impactos = data if isinstance(data, list) else [data]
+        
+        conn = db.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT id_aspecto FROM aspectos_ambientales")
+        ids_aspectos = {fila[0] for fila in cursor.fetchall()}
+        
+        try:
+            filas = [validar_impacto(impacto or {}, ids_aspectos) for impacto in impactos]
+        except (ValueError, AttributeError) as e:
+            conn.close()
+            return jsonify({'success': False, 'message': str(e)}), 400
+        
+        cursor.executemany(f'''
+            INSERT INTO impactos_ambientales ({', '.join(CAMPOS_IMPACTO)})
+            VALUES ({', '.join('?' * len(CAMPOS_IMPACTO))})
+        ''', filas)
+        conn.commit()
+        conn.close()
+        
+        return jsonify({
+            'success': True,
+            'message': f'{len(filas)} impactos registrados correctamente',
+            'impactos_procesados': len(filas)
+        })
+    
+    except Exception as e:
+        logger.error(f"Error al registrar impactos: {e}")
+        return jsonify({'success': False, 'message': f'Error interno: {str(e)}'}), 500
+
+@app.route('/api/impactos/matriz')
+def matriz_impactos():
+    """
+    Matriz de impactos aspectos x componentes en formato columnar.
+    Cada celda suma la significancia de los impactos de ese aspecto sobre el
+    componente. Cada aspecto incluye la tasa de excedencia actual de los
+    componentes que afecta (últimos 30 días de mediciones, por tipo_matriz) y
+    una significancia ajustada: |significancia total| * (1 + tasa).
+    """
+    try:
+        evaluacion = evaluar_impactos()
+        excedencia = excedencia_por_componente()
+        
+        suma = evaluacion['suma']
+        cantidad = evaluacion['cantidad']
+        
+        # Tasa de cada columna (NaN si ningún parámetro mide ese componente)
+        tasas = np.array([
+            excedencia.get(c.lower(), {}).get('tasa', np.nan) for c in evaluacion['componentes']
+        ], dtype=float)
+        
+        # Tasa del aspecto: promedio de sus componentes ponderado por cantidad de impactos
+        pesos = cantidad * ~np.isnan(tasas)
+        total_pesos = pesos.sum(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            tasa_aspectos = (pesos * np.nan_to_num(tasas)).sum(axis=1) / total_pesos
+        significancia_total = suma.sum(axis=1)
+        ajustada = np.abs(significancia_total) * (1 + np.nan_to_num(tasa_aspectos))
+        
+        aspectos = [
+            dict(
+                aspecto,
+                significancia_total=round(float(significancia_total[i]), 2),
+                tasa_excedencia=None if total_pesos[i] == 0 else round(float(tasa_aspectos[i]), 4),
+                significancia_ajustada=round(float(ajustada[i]), 2)
+            )
+            for i, aspecto in enumerate(evaluacion['aspectos'])
+        ]
+        
+        return jsonify({
+            'aspectos': aspectos,
+            'componentes': evaluacion['componentes'],
+            'significancia': np.round(suma, 2).tolist(),
+            'cantidad': cantidad.tolist(),
+            'excedencia_componentes': excedencia
+        })
+    
+    except Exception as e:
+        logger.error(f"Error al generar matriz de impactos: {e}")
+        return jsonify({'error': 'Error interno del servidor'}), 500
+
 # ==================== EXPORTACIÓN DE DATOS ====================
 
+CONSULTA_DATOS_COMPLETOS = '''
+    SELECT m.fecha_medicion, e.nombre_estacion, p.nombre_parametro, 
+           m.valor_medido, p.unidad_medida, p.valor_limite_permisible,
+           m.responsable_medicion, m.condiciones_climaticas, m.observaciones,
+           CASE 
+               WHEN m.valor_medido > p.valor_limite_permisible THEN 'Excede límite'
+               ELSE 'Normal'
+           END as estado
+    FROM mediciones m
+    JOIN estaciones_monitoreo e ON m.id_estacion = e.id_estacion
+    JOIN parametros_ambientales p ON m.id_parametro = p.id_parametro
+    ORDER BY m.fecha_medicion DESC
+'''
+
+ENCABEZADOS_EXPORTACION = [
+    'Fecha', 'Estación', 'Parámetro', 'Valor', 'Unidad', 
+    'Límite', 'Responsable', 'Condiciones', 'Observaciones', 'Estado'
+]
+
 def obtener_datos_completos():
     """Obtiene todos los datos de mediciones para exportación"""
     try:
         conn = db.get_connection()
         cursor = conn.cursor()
         
-        cursor.execute('''
-            SELECT m.fecha_medicion, e.nombre_estacion, p.nombre_parametro, 
-                   m.valor_medido, p.unidad_medida, p.valor_limite_permisible,
-                   m.responsable_medicion, m.condiciones_climaticas, m.observaciones,
-                   CASE 
-                       WHEN m.valor_medido > p.valor_limite_permisible THEN 'Excede límite'
-                       ELSE 'Normal'
-                   END as estado
-            FROM mediciones m
-            JOIN estaciones_monitoreo e ON m.id_estacion = e.id_estacion
-            JOIN parametros_ambientales p ON m.id_parametro = p.id_parametro
-            ORDER BY m.fecha_medicion DESC
-        ''')
+        cursor.execute(CONSULTA_DATOS_COMPLETOS)
         
         datos = cursor.fetchall()
         conn.close()
@@ -571,39 +1687,51 @@ def obtener_datos_completos():
         logger.error(f"Error al obtener datos completos: {e}")
         return []
 
+def iterar_datos_completos(tamano_lote=1000):
+    """Recorre los datos de exportación por lotes sin cargarlos todos en memoria"""
+    conn = db.get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(CONSULTA_DATOS_COMPLETOS)
+        while True:
+            lote = cursor.fetchmany(tamano_lote)
+            if not lote:
+                break
+            yield lote
+    finally:
+        conn.close()
+
 @app.route('/exportar/csv')
 def exportar_csv():
-    """Exporta todos los datos a formato CSV"""
+    """Exporta todos los datos a formato CSV (en streaming, un lote a la vez)"""
     try:
-        datos = obtener_datos_completos()
+        lotes = iterar_datos_completos()
+        primer_lote = next(lotes, None)
         
-        if not datos:
+        if not primer_lote:
             return jsonify({'error': 'No hay datos para exportar'}), 404
         
-        # Crear buffer en memoria
-        output = io.StringIO()
-        writer = csv.writer(output)
-        
-        # Escribir encabezados
-        headers = [
-            'Fecha', 'Estación', 'Parámetro', 'Valor', 'Unidad', 
-            'Límite', 'Responsable', 'Condiciones', 'Observaciones', 'Estado'
-        ]
-        writer.writerow(headers)
-        
-        # Escribir datos
-        for fila in datos:
-            writer.writerow(fila)
-        
-        output.seek(0)
+        def generar_csv():
+            # Buffer reutilizado: se vacía después de enviar cada lote
+            output = io.StringIO()
+            writer = csv.writer(output)
+            writer.writerow(ENCABEZADOS_EXPORTACION)
+            
+            total = 0
+            for lote in itertools.chain([primer_lote], lotes):
+                writer.writerows(lote)
+                total += len(lote)
+                yield output.getvalue()
+                output.seek(0)
+                output.truncate(0)
+            
+            logger.info(f"Exportados {total} registros a CSV")
         
         # Crear respuesta HTTP
-        response = make_response(output.getvalue())
-        response.headers['Content-Type'] = 'text/csv; charset=utf-8'
+        response = Response(generar_csv(), content_type='text/csv; charset=utf-8')
         filename = f'monitoreo_ambiental_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
         response.headers['Content-Disposition'] = f'attachment; filename={filename}'
         
-        logger.info(f"Exportando {len(datos)} registros a CSV")
         return response
         
     except Exception as e:
@@ -620,10 +1748,7 @@ def exportar_excel():
             return jsonify({'error': 'No hay datos para exportar'}), 404
         
         # Crear DataFrame
-        df = pd.DataFrame(datos, columns=[
-            'Fecha', 'Estación', 'Parámetro', 'Valor', 'Unidad', 
-            'Límite', 'Responsable', 'Condiciones', 'Observaciones', 'Estado'
-        ])
+        df = pd.DataFrame(datos, columns=ENCABEZADOS_EXPORTACION)
         
         # Crear buffer en memoria
         output = io.BytesIO()
@@ -0,0 +1,82 @@
+"""
+Benchmark de tamaño de respuesta por endpoint.
+
+Carga mediciones sintéticas en una base temporal y mide los bytes enviados
+por cada endpoint sin compresión, con gzip y con brotli (si está instalado),
+además del formato columnar del gráfico frente a la lista de objetos.
+
+Uso (desde la raíz del proyecto):
+    python benchmarks/tamano_payloads.py [cantidad_mediciones]
+"""
+import os
+import sys
+import random
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as aplicacion
+from database.models import DatabaseManager
+from database.columnar import ColumnarSnapshot
+
+ENDPOINTS = [
+    '/api/datos/recientes',
+    '/api/datos_grafico/pH',
+    '/api/datos_grafico/pH?formato=columnar',
+    '/exportar/csv',
+    '/exportar/excel',
+]
+
+CODIFICACIONES = ['identity', 'gzip'] + (['br'] if aplicacion.brotli else [])
+
+
+def poblar(db, cantidad):
+    """Inserta mediciones aleatorias repartidas en los últimos 30 días"""
+    conn = db.get_connection()
+    ahora = datetime.now()
+    filas = [
+        (
+            random.randint(1, 2),
+            random.randint(1, 4),
+            round(random.uniform(5, 30), 2),
+            (ahora - timedelta(minutes=random.randint(0, 30 * 24 * 60))).strftime('%Y-%m-%d %H:%M:%S'),
+            'Benchmark',
+            'Soleado',
+            ''
+        )
+        for _ in range(cantidad)
+    ]
+    conn.executemany('''
+        INSERT INTO mediciones
+        (id_estacion, id_parametro, valor_medido, fecha_medicion,
+         responsable_medicion, condiciones_climaticas, observaciones)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', filas)
+    conn.commit()
+    conn.close()
+
+
+def main():
+    cantidad = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    with tempfile.TemporaryDirectory() as directorio:
+        # Base y snapshot temporales para no tocar los datos reales
+        aplicacion.db = DatabaseManager(os.path.join(directorio, 'benchmark.db'))
+        aplicacion.snapshot = ColumnarSnapshot(aplicacion.db, os.path.join(directorio, 'columnar'))
+        poblar(aplicacion.db, cantidad)
+
+        cliente = aplicacion.app.test_client()
+        print(f"Mediciones: {cantidad}")
+        print(f"{'Endpoint':45}" + ''.join(f"{c:>12}" for c in CODIFICACIONES))
+
+        for endpoint in ENDPOINTS:
+            tamanos = []
+            for codificacion in CODIFICACIONES:
+                respuesta = cliente.get(endpoint, headers={'Accept-Encoding': codificacion})
+                tamanos.append(len(respuesta.get_data()))
+            print(f"{endpoint:45}" + ''.join(f"{t:>12,}" for t in tamanos))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+import numpy as np
+
+
+def fusionar_intervalos(inicios, fines):
+    """
+    Une intervalos [inicio, fin) que se solapan o se tocan.
+    Returns:
+        tuple: (inicios, fines) ordenados y sin solapamientos
+    """
+    inicios = np.asarray(inicios, dtype=np.int64)
+    fines = np.asarray(fines, dtype=np.int64)
+    if inicios.size == 0:
+        return inicios, fines
+
+    orden = np.argsort(inicios, kind='stable')
+    inicios, fines = inicios[orden], fines[orden]
+
+    # Fin acumulado: un intervalo abre un bloque nuevo si empieza después
+    # de que terminaron todos los anteriores
+    fin_acumulado = np.maximum.accumulate(fines)
+    nuevo_bloque = np.empty(inicios.size, dtype=bool)
+    nuevo_bloque[0] = True
+    nuevo_bloque[1:] = inicios[1:] > fin_acumulado[:-1]
+
+    bloques = np.flatnonzero(nuevo_bloque)
+    ultimos = np.append(bloques[1:], inicios.size) - 1
+    return inicios[bloques], fin_acumulado[ultimos]
+
+
+def dentro_de_intervalos(tiempos, inicios, fines):
+    """
+    Marca qué tiempos caen dentro de algún intervalo ya fusionado.
+    Usa búsqueda binaria sobre los inicios ordenados: O(n log m) en lugar
+    de comparar cada lectura con cada intervalo.
+    """
+    if inicios.size == 0:
+        return np.zeros(len(tiempos), dtype=bool)
+    indice = np.searchsorted(inicios, tiempos, side='right') - 1
+    validos = indice >= 0
+    dentro = np.zeros(len(tiempos), dtype=bool)
+    dentro[validos] = tiempos[validos] < fines[indice[validos]]
+    return dentro
+
+
+def _sumas_por_estacion(estaciones, valores, mascara, ids_estaciones):
+    """Suma y cantidad de valores por estación para las filas seleccionadas"""
+    cantidades = np.bincount(estaciones[mascara], minlength=len(ids_estaciones))
+    sumas = np.bincount(estaciones[mascara], weights=valores[mascara], minlength=len(ids_estaciones))
+    return sumas, cantidades
+
+
+def comparar_actividad_inactividad(tiempos, valores, estaciones, intervalos_por_tipo):
+    """
+    Compara lecturas tomadas durante cada tipo de actividad contra los
+    periodos sin ninguna actividad, estación por estación.
+    Args:
+        tiempos, valores, estaciones: Columnas de un parámetro (snapshot columnar)
+        intervalos_por_tipo: {tipo_actividad: (inicios, fines)} en segundos epoch
+    Returns:
+        dict: {tipo: {id_estacion: {...medias, delta y cantidades...}}}
+    """
+    if len(tiempos) == 0:
+        return {}
+
+    tiempos = np.asarray(tiempos)
+    valores = np.asarray(valores)
+    ids_estaciones, estaciones = np.unique(np.asarray(estaciones), return_inverse=True)
+
+    # Inactivo = fuera de todos los intervalos, sin importar el tipo
+    fusionados = {tipo: fusionar_intervalos(*intervalos) for tipo, intervalos in intervalos_por_tipo.items()}
+    todos_inicios = np.concatenate([i for i, _ in fusionados.values()] or [np.empty(0, np.int64)])
+    todos_fines = np.concatenate([f for _, f in fusionados.values()] or [np.empty(0, np.int64)])
+    inactivo = ~dentro_de_intervalos(tiempos, *fusionar_intervalos(todos_inicios, todos_fines))
+    sumas_inactivo, cantidades_inactivo = _sumas_por_estacion(estaciones, valores, inactivo, ids_estaciones)
+
+    resultado = {}
+    for tipo, (inicios, fines) in fusionados.items():
+        durante = dentro_de_intervalos(tiempos, inicios, fines)
+        sumas, cantidades = _sumas_por_estacion(estaciones, valores, durante, ids_estaciones)
+
+        por_estacion = {}
+        for i, id_estacion in enumerate(ids_estaciones):
+            if cantidades[i] == 0:
+                continue
+            media_actividad = sumas[i] / cantidades[i]
+            media_inactivo = (sumas_inactivo[i] / cantidades_inactivo[i]
+                              if cantidades_inactivo[i] else None)
+            por_estacion[int(id_estacion)] = {
+                'media_actividad': round(float(media_actividad), 4),
+                'media_inactivo': None if media_inactivo is None else round(float(media_inactivo), 4),
+                'delta': None if media_inactivo is None else round(float(media_actividad - media_inactivo), 4),
+                'mediciones_actividad': int(cantidades[i]),
+                'mediciones_inactivo': int(cantidades_inactivo[i]),
+            }
+        resultado[tipo] = por_estacion
+
+    return resultado
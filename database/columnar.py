@@ -0,0 +1,324 @@
+import calendar
+import json
+import os
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import fcntl  # Bloqueo entre procesos (workers de gunicorn)
+except ImportError:  # Windows: solo se protege dentro del proceso
+    fcntl = None
+
+# Columnas guardadas por parámetro: nombre de archivo y tipo NumPy
+COLUMNAS = (
+    ('tiempos', np.int64),      # segundos epoch de fecha_medicion
+    ('valores', np.float64),    # valor_medido
+    ('estaciones', np.int32),   # id_estacion (-1 si es NULL)
+)
+
+
+def segundos_epoch(fecha):
+    """Convierte un datetime sin zona al mismo formato que strftime('%s') de SQLite"""
+    return calendar.timegm(fecha.timetuple())
+
+
+class ColumnarSnapshot:
+    """
+    Copia columnar de la tabla mediciones para lecturas analíticas.
+
+    Cada parámetro tiene un archivo binario por columna que se lee con
+    np.memmap en modo solo lectura, así los workers de gunicorn comparten
+    las mismas páginas del sistema operativo sin copiar filas a tuplas.
+    Las filas nuevas se agregan al final con sync(); meta.json guarda el
+    último id_medicion copiado y cuántas filas son válidas en cada archivo.
+
+    Los nombres de archivo llevan la generación del snapshot. Una
+    reconstrucción escribe archivos nuevos, cambia meta.json y recién
+    después borra los de generaciones anteriores, así un lector sin bloqueo
+    nunca encuentra un archivo recreado o más corto de lo que dice meta.json.
+    """
+
+    def __init__(self, db, directorio='database/columnar', lote=50000):
+        self.db = db
+        self.directorio = directorio
+        self.lote = lote
+        self._lock = threading.Lock()
+        self._mapas = {}
+        os.makedirs(directorio, exist_ok=True)
+
+    # ==================== ARCHIVOS Y METADATOS ====================
+
+    def _ruta(self, nombre):
+        return os.path.join(self.directorio, nombre)
+
+    def _ruta_columna(self, generacion, id_parametro, columna):
+        return self._ruta(f'param_{generacion}_{id_parametro}_{columna}.bin')
+
+    def _meta_vacia(self, generacion=0):
+        return {'generacion': generacion, 'reservada': generacion, 'ultimo_id': 0, 'filas': {}}
+
+    def _leer_meta(self):
+        try:
+            with open(self._ruta('meta.json'), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return self._meta_vacia()
+
+    def _escribir_meta(self, meta):
+        """Escribe meta.json de forma atómica para que los lectores nunca vean un estado parcial"""
+        temporal = self._ruta('meta.json.tmp')
+        with open(temporal, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(temporal, self._ruta('meta.json'))
+
+    @contextmanager
+    def _bloqueo(self):
+        with self._lock:
+            with open(self._ruta('.lock'), 'a') as archivo_lock:
+                if fcntl:
+                    fcntl.flock(archivo_lock, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    if fcntl:
+                        fcntl.flock(archivo_lock, fcntl.LOCK_UN)
+
+    def _borrar_generaciones_anteriores(self, generacion):
+        """Borra los archivos de generaciones anteriores (y los de nombre sin generación)"""
+        for nombre in os.listdir(self.directorio):
+            partes = nombre.split('_')
+            if partes[0] != 'param':
+                continue
+            if len(partes) == 4 and partes[1].isdigit() and int(partes[1]) >= generacion:
+                continue
+            try:
+                os.remove(self._ruta(nombre))
+            except OSError:
+                pass  # Windows no borra archivos mapeados; se reintenta en la próxima generación
+
+    def _reservar_generacion(self, meta):
+        """
+        Número para una generación nueva, mayor que la actual y que las reservadas
+        por reconstrucciones en curso. Se llama con el bloqueo tomado.
+        """
+        generacion = max(meta['generacion'], meta.get('reservada', 0)) + 1
+        meta['reservada'] = generacion
+        return generacion
+
+    def _nueva_generacion(self, meta):
+        """Cambia meta.json a una generación vacía y borra los archivos de las anteriores"""
+        meta = self._meta_vacia(self._reservar_generacion(meta))
+        self._escribir_meta(meta)
+        self._borrar_generaciones_anteriores(meta['generacion'])
+        return meta
+
+    def _recortar(self, meta):
+        """
+        Deja cada archivo con exactamente las filas registradas en meta.json.
+        Si un proceso murió a mitad de un append quedan bytes de más; si falta
+        algún archivo el snapshot no es confiable y se reconstruye desde cero.
+        """
+        for id_parametro, filas in meta['filas'].items():
+            for columna, dtype in COLUMNAS:
+                ruta = self._ruta_columna(meta['generacion'], id_parametro, columna)
+                esperado = filas * np.dtype(dtype).itemsize
+                tamano = os.path.getsize(ruta) if os.path.exists(ruta) else -1
+                if tamano < esperado:
+                    return self._nueva_generacion(meta)
+                if tamano > esperado:
+                    os.truncate(ruta, esperado)
+        return meta
+
+    # ==================== ESCRITURA ====================
+
+    def sync(self):
+        """
+        Agrega al snapshot las mediciones con id_medicion mayor al último copiado.
+        Returns:
+            int: Último id_medicion incluido en el snapshot
+        """
+        # Camino rápido sin bloqueo: si no hay filas nuevas no hay nada que agregar.
+        # MAX(id_medicion) se resuelve con la clave primaria sin recorrer la tabla.
+        ultimo_id = self._leer_meta()['ultimo_id']
+        conn = self.db.get_connection()
+        try:
+            maximo = conn.execute("SELECT MAX(id_medicion) FROM mediciones").fetchone()[0] or 0
+        finally:
+            conn.close()
+        if maximo <= ultimo_id:
+            return ultimo_id
+
+        with self._bloqueo():
+            meta = self._recortar(self._leer_meta())
+            self._copiar(meta)
+            return meta['ultimo_id']
+
+    def rebuild(self):
+        """
+        Reconstruye el snapshot completo en una generación nueva (después de
+        borrar o modificar mediciones en bloque). La copia se hace sin el
+        bloqueo: mientras tanto los lectores y sync() siguen con la generación
+        actual. El bloqueo solo se toma para reservar la generación y, al final,
+        para agregar las filas llegadas durante la copia y cambiar meta.json.
+        Returns:
+            int: Último id_medicion incluido en el snapshot
+        """
+        with self._bloqueo():
+            actual = self._leer_meta()
+            generacion = self._reservar_generacion(actual)
+            self._escribir_meta(actual)
+
+        meta = self._meta_vacia(generacion)
+        self._copiar(meta, guardar=False)
+
+        with self._bloqueo():
+            actual = self._leer_meta()
+            if actual['generacion'] > generacion:
+                # Otra reconstrucción más reciente ya está en uso: se descarta esta copia
+                self._borrar_generaciones_anteriores(actual['generacion'])
+                return actual['ultimo_id']
+            self._copiar(meta, guardar=False)
+            meta['reservada'] = max(generacion, actual.get('reservada', 0))
+            self._escribir_meta(meta)
+
+        self._borrar_generaciones_anteriores(generacion)
+        return meta['ultimo_id']
+
+    def _copiar(self, meta, guardar=True):
+        """
+        Agrega a los archivos de la generación de meta las mediciones con
+        id_medicion mayor a meta['ultimo_id']. Con guardar=True escribe
+        meta.json después de cada lote (solo para la generación en uso).
+        """
+        conn = self.db.get_connection()
+        try:
+            cursor = conn.execute('''
+                SELECT id_medicion, id_parametro, id_estacion,
+                       CAST(strftime('%s', fecha_medicion) AS INTEGER), valor_medido
+                FROM mediciones
+                WHERE id_medicion > ?
+                ORDER BY id_medicion
+            ''', (meta['ultimo_id'],))
+
+            while True:
+                filas = cursor.fetchmany(self.lote)
+                if not filas:
+                    break
+                self._agregar_lote(meta, filas)
+                if guardar:
+                    self._escribir_meta(meta)
+        finally:
+            conn.close()
+
+    def _agregar_lote(self, meta, filas):
+        meta['ultimo_id'] = filas[-1][0]
+
+        # Las filas sin parámetro, fecha o valor no sirven para análisis
+        filas = [f for f in filas if f[1] is not None and f[3] is not None and f[4] is not None]
+        if not filas:
+            return
+
+        _, parametros, estaciones, tiempos, valores = zip(*filas)
+        columnas = {
+            'tiempos': np.array(tiempos, dtype=np.int64),
+            'valores': np.array(valores, dtype=np.float64),
+            'estaciones': np.array([-1 if e is None else e for e in estaciones], dtype=np.int32),
+        }
+        parametros = np.array(parametros, dtype=np.int64)
+
+        for id_parametro in np.unique(parametros):
+            mascara = parametros == id_parametro
+            clave = str(int(id_parametro))
+            for columna, _ in COLUMNAS:
+                with open(self._ruta_columna(meta['generacion'], clave, columna), 'ab') as f:
+                    columnas[columna][mascara].tofile(f)
+            meta['filas'][clave] = meta['filas'].get(clave, 0) + int(mascara.sum())
+
+    def invalidate(self):
+        """Descarta el snapshot; el próximo sync() lo reconstruye desde la tabla mediciones"""
+        with self._bloqueo():
+            self._nueva_generacion(self._leer_meta())
+            self._mapas.clear()
+
+    # ==================== LECTURA ====================
+
+    def read(self, id_parametro):
+        """
+        Devuelve las columnas de un parámetro como arreglos de solo lectura.
+        Returns:
+            tuple: (tiempos, valores, estaciones) en el orden de inserción
+        """
+        for intento in range(3):
+            meta = self._leer_meta()
+            filas = meta['filas'].get(str(id_parametro), 0)
+            if filas == 0:
+                return tuple(np.empty(0, dtype=dtype) for _, dtype in COLUMNAS)
+
+            # Se vuelve a mapear solo si el archivo creció o el snapshot se reconstruyó
+            version = (meta['generacion'], filas)
+            mapa = self._mapas.get(id_parametro)
+            if mapa is not None and mapa[0] == version:
+                return mapa[1]
+
+            try:
+                arreglos = tuple(
+                    np.memmap(self._ruta_columna(meta['generacion'], id_parametro, columna),
+                              dtype=dtype, mode='r', shape=(filas,))
+                    for columna, dtype in COLUMNAS
+                )
+            except (FileNotFoundError, ValueError):
+                # Entre leer meta.json y abrir los archivos otra generación tomó su
+                # lugar y los borró: se vuelve a leer meta.json
+                if intento == 2:
+                    raise
+                continue
+
+            self._mapas[id_parametro] = (version, arreglos)
+            return arreglos
+
+    def read_many(self, ids_parametros):
+        """Concatena las columnas de varios parámetros (por ejemplo, búsquedas con LIKE)"""
+        partes = [self.read(id_parametro) for id_parametro in ids_parametros]
+        if len(partes) == 1:
+            return partes[0]
+        if not partes:
+            return tuple(np.empty(0, dtype=dtype) for _, dtype in COLUMNAS)
+        return tuple(np.concatenate(columna) for columna in zip(*partes))
+
+    # ==================== ANALÍTICA ====================
+
+    def daily_means(self, ids_parametros, desde):
+        """
+        Promedio y cantidad de mediciones por día desde una fecha.
+        Returns:
+            list: Tuplas (fecha 'YYYY-MM-DD', promedio, cantidad) ordenadas por fecha
+        """
+        tiempos, valores, _ = self.read_many(ids_parametros)
+        mascara = tiempos >= segundos_epoch(desde)
+        dias = tiempos[mascara] // 86400
+        if dias.size == 0:
+            return []
+
+        unicos, indices = np.unique(dias, return_inverse=True)
+        cantidades = np.bincount(indices)
+        sumas = np.bincount(indices, weights=valores[mascara])
+
+        return [
+            (np.datetime_as_string(np.datetime64(int(dia), 'D')), float(suma / cantidad), int(cantidad))
+            for dia, suma, cantidad in zip(unicos, sumas, cantidades)
+        ]
+
+    def summary(self, id_parametro, desde):
+        """
+        Resumen de un parámetro desde una fecha.
+        Returns:
+            tuple: (cantidad, promedio, mínimo, máximo) o None si no hay datos
+        """
+        tiempos, valores, _ = self.read(id_parametro)
+        seleccion = valores[tiempos >= segundos_epoch(desde)]
+        if seleccion.size == 0:
+            return None
+        return (int(seleccion.size), float(seleccion.mean()),
+                float(seleccion.min()), float(seleccion.max()))
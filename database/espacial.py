@@ -0,0 +1,88 @@
+"""
+Índice espacial de estaciones de monitoreo.
+
+Las estaciones se ordenan por latitud: un rectángulo del mapa es un tramo
+contiguo del arreglo (dos búsquedas binarias) que luego se filtra por
+longitud. La estación más cercana se busca en franjas de latitud cada vez
+más anchas, hasta que ninguna estación fuera de la franja pueda estar más
+cerca que la mejor encontrada. Con miles de estaciones ambas consultas
+toman microsegundos.
+"""
+import numpy as np
+
+RADIO_TIERRA_KM = 6371.0
+KM_POR_GRADO = np.pi * RADIO_TIERRA_KM / 180  # distancia de un grado de latitud
+FRANJA_INICIAL = 0.25  # grados de latitud a cada lado del punto buscado
+
+
+def distancia_km(latitud, longitud, latitudes, longitudes):
+    """Distancia haversine en km desde un punto a cada una de las coordenadas"""
+    lat1, lon1 = np.radians(latitud), np.radians(longitud)
+    lat2, lon2 = np.radians(latitudes), np.radians(longitudes)
+    a = (np.sin((lat2 - lat1) / 2) ** 2
+         + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * RADIO_TIERRA_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+class IndiceEstaciones:
+    """Coordenadas de estaciones ordenadas por latitud"""
+
+    def __init__(self, ids, latitudes, longitudes):
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        orden = np.argsort(latitudes, kind='stable')
+        self.ids = np.asarray(ids, dtype=np.int64)[orden]
+        self.latitudes = latitudes[orden]
+        self.longitudes = np.asarray(longitudes, dtype=np.float64)[orden]
+
+    def __len__(self):
+        return self.ids.size
+
+    def _tramo(self, lat_min, lat_max):
+        inicio = np.searchsorted(self.latitudes, lat_min, side='left')
+        fin = np.searchsorted(self.latitudes, lat_max, side='right')
+        return slice(inicio, fin)
+
+    def en_rectangulo(self, lat_min, lon_min, lat_max, lon_max):
+        """
+        Ids de las estaciones dentro de un rectángulo (bordes incluidos).
+        Si lon_min > lon_max el rectángulo cruza el antimeridiano.
+        """
+        tramo = self._tramo(lat_min, lat_max)
+        longitudes = self.longitudes[tramo]
+        if lon_min <= lon_max:
+            dentro = (longitudes >= lon_min) & (longitudes <= lon_max)
+        else:
+            dentro = (longitudes >= lon_min) | (longitudes <= lon_max)
+        return self.ids[tramo][dentro]
+
+    def mas_cercana(self, latitud, longitud, radio_km=None):
+        """
+        Estación más cercana a un punto
+        Args:
+            latitud, longitud: Coordenadas en grados
+            radio_km: Distancia máxima aceptada (None = sin límite)
+        Returns:
+            tuple: (id_estacion, distancia_km) o None si no hay ninguna en el radio
+        """
+        if not len(self):
+            return None
+
+        franja = FRANJA_INICIAL
+        while True:
+            tramo = self._tramo(latitud - franja, latitud + franja)
+            if tramo.stop > tramo.start:
+                distancias = distancia_km(
+                    latitud, longitud, self.latitudes[tramo], self.longitudes[tramo]
+                )
+                mejor = int(np.argmin(distancias))
+                # Fuera de la franja la diferencia de latitud ya supera franja grados
+                if distancias[mejor] <= franja * KM_POR_GRADO or franja >= 180:
+                    break
+            elif radio_km is not None and franja * KM_POR_GRADO > radio_km:
+                return None
+            franja *= 4
+
+        distancia = float(distancias[mejor])
+        if radio_km is not None and distancia > radio_km:
+            return None
+        return int(self.ids[tramo][mejor]), distancia
@@ -0,0 +1,116 @@
+"""
+Evaluación vectorizada de impactos ambientales.
+
+La significancia de cada impacto sigue la matriz de Leopold: magnitud e
+importancia (1 a 10) ponderadas por factores de reversibilidad y duración
+(1 a 2). El resultado se normaliza a 0-100 y se clasifica con los rangos
+de Conesa: compatible (<25), moderado (<50), severo (<75) y crítico.
+"""
+import numpy as np
+import pandas as pd
+
+FACTORES_REVERSIBILIDAD = {
+    'reversible': 1.0,
+    'corto plazo': 1.0,
+    'recuperable': 1.5,
+    'mediano plazo': 1.5,
+    'irreversible': 2.0,
+    'largo plazo': 2.0,
+}
+
+FACTORES_DURACION = {
+    'fugaz': 1.0,
+    'temporal': 1.0,
+    'corto plazo': 1.0,
+    'periodica': 1.5,
+    'periódica': 1.5,
+    'mediano plazo': 1.5,
+    'permanente': 2.0,
+    'largo plazo': 2.0,
+}
+
+# Factor usado cuando el texto no coincide con ninguna categoría conocida
+FACTOR_POR_DEFECTO = 1.5
+
+SIGNIFICANCIA_MAXIMA = 10 * 10 * 2.0 * 2.0
+NIVELES = (25, 50, 75)
+NOMBRES_NIVELES = np.array(['compatible', 'moderado', 'severo', 'critico'])
+
+
+def factores_texto(textos, tabla, por_defecto=FACTOR_POR_DEFECTO):
+    """
+    Traduce una columna de texto a factores numéricos.
+    pd.factorize agrupa por hash y solo se normalizan los valores distintos;
+    los NULL reciben el código -1, que apunta al factor por defecto del final.
+    """
+    codigos, unicos = pd.factorize(np.asarray(textos, dtype=object))
+    factores = np.array(
+        [tabla.get((u or '').strip().lower(), por_defecto) for u in unicos] + [por_defecto],
+        dtype=float
+    )
+    return factores[codigos]
+
+
+def factorizar_componentes(componentes, vacio='Sin especificar'):
+    """
+    Códigos de componente por fila y categorías ordenadas, unificando
+    mayúsculas y espacios ('Agua ' y 'agua' son el mismo componente)
+    Returns:
+        tuple: (códigos, categorías)
+    """
+    codigos, unicos = pd.factorize(np.asarray(componentes, dtype=object))
+    nombres = [((u or '').strip() or vacio).capitalize() for u in unicos]
+    if (codigos == -1).any():
+        nombres.append(vacio)  # los NULL (código -1) apuntan a este último nombre
+    codigos_nombres, categorias = pd.factorize(np.array(nombres, dtype=object), sort=True)
+    return codigos_nombres[codigos], categorias
+
+
+def calcular_significancia(magnitud, importancia, reversibilidad, duracion, tipo_impacto):
+    """
+    Significancia normalizada (0-100, con signo) y nivel de cada impacto
+    Args:
+        magnitud, importancia: Valores de 1 a 10 (None = sin evaluar)
+        reversibilidad, duracion: Textos de la tabla impactos_ambientales
+        tipo_impacto: 'positivo' o 'negativo' (define el signo)
+    Returns:
+        tuple: (significancia, niveles); NaN y 'sin evaluar' si falta magnitud o importancia
+    """
+    magnitud = np.clip(np.array(magnitud, dtype=float), 1, 10)
+    importancia = np.clip(np.array(importancia, dtype=float), 1, 10)
+
+    bruto = (magnitud * importancia
+             * factores_texto(reversibilidad, FACTORES_REVERSIBILIDAD)
+             * factores_texto(duracion, FACTORES_DURACION))
+    significancia = np.round(100 * bruto / SIGNIFICANCIA_MAXIMA, 2)
+
+    niveles = NOMBRES_NIVELES[np.searchsorted(NIVELES, np.nan_to_num(significancia), side='right')]
+    niveles = np.where(np.isnan(significancia), 'sin evaluar', niveles)
+
+    signo = factores_texto(tipo_impacto, {'negativo': -1.0}, por_defecto=1.0)
+    return significancia * signo, niveles
+
+
+def matriz_aspecto_componente(ids_aspectos, codigos_componentes, componentes, significancia):
+    """
+    Agrega la significancia en una matriz aspectos x componentes.
+    Los impactos sin evaluar cuentan en cantidad pero no en la suma.
+    Args:
+        ids_aspectos: id_aspecto de cada impacto
+        codigos_componentes, componentes: Resultado de factorizar_componentes()
+        significancia: Resultado de calcular_significancia()
+    Returns:
+        tuple: (ids de aspectos, suma de significancia, cantidad de impactos)
+    """
+    filas, indice_filas = np.unique(np.asarray(ids_aspectos, dtype=np.int64), return_inverse=True)
+    columnas, indice_columnas = componentes, codigos_componentes
+    celdas = indice_filas * len(columnas) + indice_columnas
+    tamano = len(filas) * len(columnas)
+
+    evaluados = ~np.isnan(significancia)
+    suma = np.bincount(celdas[evaluados], weights=significancia[evaluados], minlength=tamano)
+    cantidad = np.bincount(celdas, minlength=tamano)
+
+    forma = (len(filas), len(columnas))
+    return filas, suma.reshape(forma), cantidad.reshape(forma)
+
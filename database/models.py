@@ -2,6 +2,17 @@ import sqlite3
 import os
 from datetime import datetime
 
+# Tablas cuya versión se incrementa con triggers en cada INSERT/UPDATE/DELETE
+TABLAS_VERSIONADAS = (
+    'estaciones_monitoreo', 'parametros_ambientales',
+    'aspectos_ambientales', 'impactos_ambientales'
+)
+
+# mediciones no lleva triggers de versión: serían un UPDATE extra por cada fila
+# insertada en la tabla más escrita. Su versión es MAX(id_medicion) junto con un
+# contador que suben una vez por lote los procesos que borran o modifican en bloque.
+TABLA_MEDICIONES = 'mediciones'
+
 class DatabaseManager:
     def __init__(self, db_path='database/puerto_huacho.db'):
         self.db_path = db_path
@@ -15,6 +26,11 @@ class DatabaseManager:
         conn = self.get_connection()
         cursor = conn.cursor()
         
+        # Vacuum incremental para que la retención pueda devolver espacio al disco
+        # (solo tiene efecto en bases nuevas; las existentes se convierten en
+        # la primera ejecución de database/retencion.py)
+        cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        
         # Tabla: Estaciones de Monitoreo
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS estaciones_monitoreo (
@@ -51,11 +67,97 @@ class DatabaseManager:
                 responsable_medicion TEXT,
                 condiciones_climaticas TEXT,
                 observaciones TEXT,
+                fecha_dispositivo DATETIME,
+                clave_idempotencia TEXT,
+                id_dispositivo TEXT,
+                FOREIGN KEY (id_estacion) REFERENCES estaciones_monitoreo (id_estacion),
+                FOREIGN KEY (id_parametro) REFERENCES parametros_ambientales (id_parametro)
+            )
+        ''')
+        
+        # Columnas agregadas después de la primera versión de la tabla
+        self.add_column_if_missing(cursor, 'mediciones', 'fecha_dispositivo', 'DATETIME')
+        self.add_column_if_missing(cursor, 'mediciones', 'clave_idempotencia', 'TEXT')
+        self.add_column_if_missing(cursor, 'mediciones', 'id_dispositivo', 'TEXT')
+        
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_mediciones_fecha
+            ON mediciones (fecha_medicion)
+        ''')
+        
+        # Reintentos de dispositivos: una lectura por dispositivo, parámetro y hora
+        # del dispositivo, o por clave de idempotencia y parámetro. La estación no
+        # identifica al emisor (varios dispositivos comparten estación), por eso sin
+        # id_dispositivo no se descarta nada por hora. Los índices son parciales: las
+        # filas sin esos datos (formulario web) no los mantienen ni chocan entre sí.
+        cursor.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_mediciones_lectura_dispositivo
+            ON mediciones (id_dispositivo, id_parametro, fecha_dispositivo)
+            WHERE id_dispositivo IS NOT NULL AND fecha_dispositivo IS NOT NULL
+        ''')
+        cursor.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_mediciones_clave
+            ON mediciones (clave_idempotencia, id_parametro)
+            WHERE clave_idempotencia IS NOT NULL
+        ''')
+        
+        # Tabla: Resúmenes horarios de mediciones compactadas por la retención
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS mediciones_resumen (
+                id_estacion INTEGER,
+                id_parametro INTEGER,
+                periodo DATETIME NOT NULL,
+                cantidad INTEGER NOT NULL,
+                suma REAL NOT NULL,
+                minimo REAL,
+                maximo REAL,
+                PRIMARY KEY (id_estacion, id_parametro, periodo),
                 FOREIGN KEY (id_estacion) REFERENCES estaciones_monitoreo (id_estacion),
                 FOREIGN KEY (id_parametro) REFERENCES parametros_ambientales (id_parametro)
             )
         ''')
         
+        # Las tendencias filtran por parámetro y periodo sin conocer la estación
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_resumen_parametro
+            ON mediciones_resumen (id_parametro, periodo)
+        ''')
+        
+        # Mediciones sin estación se resumen con id_estacion = -1 (como en el snapshot
+        # columnar): con NULL el ON CONFLICT de la retención nunca coincide y cada
+        # ejecución agregaba otra fila. Se fusionan las que ya existan.
+        cursor.execute('''
+            INSERT INTO mediciones_resumen
+            (id_estacion, id_parametro, periodo, cantidad, suma, minimo, maximo)
+            SELECT -1, id_parametro, periodo, SUM(cantidad), SUM(suma), MIN(minimo), MAX(maximo)
+            FROM mediciones_resumen
+            WHERE id_estacion IS NULL
+            GROUP BY id_parametro, periodo
+            ON CONFLICT (id_estacion, id_parametro, periodo) DO UPDATE SET
+                cantidad = cantidad + excluded.cantidad,
+                suma = suma + excluded.suma,
+                minimo = MIN(minimo, excluded.minimo),
+                maximo = MAX(maximo, excluded.maximo)
+        ''')
+        cursor.execute("DELETE FROM mediciones_resumen WHERE id_estacion IS NULL")
+
+        # Tabla: Último valor de cada parámetro por estación (mapa de estaciones).
+        # Se actualiza por lotes con update_latest_measurements(); un trigger por
+        # fila duplicaría el costo de cada INSERT en mediciones.
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'ultimas_mediciones'")
+        tabla_nueva = cursor.fetchone() is None
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS ultimas_mediciones (
+                id_estacion INTEGER,
+                id_parametro INTEGER,
+                valor_medido REAL NOT NULL,
+                fecha_medicion DATETIME NOT NULL,
+                PRIMARY KEY (id_estacion, id_parametro),
+                FOREIGN KEY (id_estacion) REFERENCES estaciones_monitoreo (id_estacion),
+                FOREIGN KEY (id_parametro) REFERENCES parametros_ambientales (id_parametro)
+            )
+        ''')
+
         # Tabla: Actividades Pesqueras
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS actividades_pesqueras (
@@ -70,6 +172,11 @@ class DatabaseManager:
             )
         ''')
         
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_actividades_fecha
+            ON actividades_pesqueras (fecha_actividad)
+        ''')
+        
         # Tabla: Aspectos Ambientales
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS aspectos_ambientales (
@@ -99,12 +206,120 @@ class DatabaseManager:
             )
         ''')
         
+        # Tabla: Versiones de tablas (claves de caché de las páginas)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS versiones_tablas (
+                tabla TEXT PRIMARY KEY,
+                version INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        
+        for tabla in TABLAS_VERSIONADAS:
+            cursor.execute(
+                "INSERT OR IGNORE INTO versiones_tablas (tabla, version) VALUES (?, 0)",
+                (tabla,)
+            )
+            for evento in ('INSERT', 'UPDATE', 'DELETE'):
+                cursor.execute(f'''
+                    CREATE TRIGGER IF NOT EXISTS version_{tabla}_{evento.lower()}
+                    AFTER {evento} ON {tabla}
+                    BEGIN
+                        UPDATE versiones_tablas SET version = version + 1
+                        WHERE tabla = '{tabla}';
+                    END
+                ''')
+        
+        # 'ultimas_mediciones' guarda el último id_medicion incorporado a esa tabla
+        cursor.executemany(
+            "INSERT OR IGNORE INTO versiones_tablas (tabla, version) VALUES (?, 0)",
+            [(TABLA_MEDICIONES,), ('ultimas_mediciones',)]
+        )
+        if tabla_nueva:
+            # Bases existentes: la carga completa se hace una sola vez aquí y no
+            # en la primera consulta del mapa. MAX() hace que valor_medido sea
+            # el de la fila más reciente del grupo.
+            cursor.execute(f'''
+                INSERT INTO ultimas_mediciones
+                (id_estacion, id_parametro, valor_medido, fecha_medicion)
+                SELECT id_estacion, id_parametro, valor_medido, MAX(fecha_medicion)
+                FROM {TABLA_MEDICIONES}
+                WHERE valor_medido IS NOT NULL AND fecha_medicion IS NOT NULL
+                GROUP BY id_estacion, id_parametro
+            ''')
+            cursor.execute(f'''
+                UPDATE versiones_tablas
+                SET version = (SELECT IFNULL(MAX(id_medicion), 0) FROM {TABLA_MEDICIONES})
+                WHERE tabla = 'ultimas_mediciones'
+            ''')
+        
         conn.commit()
         conn.close()
         
         # Insertar datos iniciales
         self.insert_initial_data()
     
+    def add_column_if_missing(self, cursor, tabla, columna, tipo):
+        """Agrega una columna a una tabla existente si todavía no la tiene"""
+        cursor.execute(f"PRAGMA table_info({tabla})")
+        if columna not in [fila[1] for fila in cursor.fetchall()]:
+            cursor.execute(f"ALTER TABLE {tabla} ADD COLUMN {columna} {tipo}")
+    
+    def update_latest_measurements(self):
+        """
+        Incorpora a ultimas_mediciones las mediciones nuevas desde la última
+        actualización, en un solo INSERT agrupado por estación y parámetro.
+        Sin mediciones nuevas solo cuesta dos lecturas por clave primaria.
+        """
+        conn = self.get_connection()
+        conn.isolation_level = None  # transacción manual
+        try:
+            consulta_marca = "SELECT version FROM versiones_tablas WHERE tabla = 'ultimas_mediciones'"
+            consulta_maximo = f"SELECT MAX(id_medicion) FROM {TABLA_MEDICIONES}"
+            marca = conn.execute(consulta_marca).fetchone()[0]
+            if (conn.execute(consulta_maximo).fetchone()[0] or 0) <= marca:
+                return
+
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Otro proceso pudo haberla actualizado mientras se esperaba el bloqueo
+                marca = conn.execute(consulta_marca).fetchone()[0]
+                maximo = conn.execute(consulta_maximo).fetchone()[0] or 0
+                # MAX() hace que valor_medido sea el de la fila más reciente del grupo
+                conn.execute(f'''
+                    INSERT INTO ultimas_mediciones
+                    (id_estacion, id_parametro, valor_medido, fecha_medicion)
+                    SELECT id_estacion, id_parametro, valor_medido, MAX(fecha_medicion)
+                    FROM {TABLA_MEDICIONES}
+                    WHERE id_medicion > ? AND id_medicion <= ?
+                      AND valor_medido IS NOT NULL AND fecha_medicion IS NOT NULL
+                    GROUP BY id_estacion, id_parametro
+                    ON CONFLICT (id_estacion, id_parametro) DO UPDATE SET
+                        valor_medido = excluded.valor_medido,
+                        fecha_medicion = excluded.fecha_medicion
+                    WHERE excluded.fecha_medicion >= ultimas_mediciones.fecha_medicion
+                ''', (marca, maximo))
+                conn.execute(
+                    "UPDATE versiones_tablas SET version = ? WHERE tabla = 'ultimas_mediciones'",
+                    (maximo,)
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            conn.close()
+    
+    def get_table_versions(self):
+        """Devuelve un diccionario {tabla: version} con la versión actual de cada tabla"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT tabla, version FROM versiones_tablas")
+        versiones = dict(cursor.fetchall())
+        cursor.execute(f"SELECT MAX(id_medicion) FROM {TABLA_MEDICIONES}")
+        versiones[TABLA_MEDICIONES] = (versiones.get(TABLA_MEDICIONES, 0), cursor.fetchone()[0] or 0)
+        conn.close()
+        return versiones
+    
     def insert_initial_data(self):
         """Insertar datos básicos para empezar"""
         conn = self.get_connection()
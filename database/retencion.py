@@ -0,0 +1,236 @@
+"""
+Retención y compactación de la tabla mediciones.
+
+Las mediciones crudas más antiguas que RETENCION_DIAS se resumen por hora
+en mediciones_resumen (cantidad, suma, mínimo y máximo, de modo que la
+media sigue disponible) y luego se eliminan en lotes pequeños, cada uno en
+su propia transacción, para no bloquear la escritura de otros procesos.
+Al final se devuelve el espacio libre al disco con vacuum incremental.
+
+Uso (desde la raíz del proyecto):
+    python -m database.retencion                      # una sola ejecución
+    python -m database.retencion --intervalo-horas 24 # proceso programado
+    python -m database.retencion --convertir          # una vez, en una ventana de
+                                                      # mantenimiento (VACUUM completo)
+"""
+import argparse
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+# Configuración por variables de entorno
+RETENCION_DIAS = int(os.environ.get('RETENCION_DIAS', 365))
+TAMANO_LOTE = int(os.environ.get('RETENCION_LOTE', 2000))
+PAUSA_LOTE = float(os.environ.get('RETENCION_PAUSA', 0.05))  # segundos entre lotes
+
+
+def compactar_mediciones(db, dias=RETENCION_DIAS, tamano_lote=TAMANO_LOTE, pausa=PAUSA_LOTE):
+    """
+    Resume por hora y elimina las mediciones anteriores al corte
+    Args:
+        db: DatabaseManager
+        dias: Antigüedad a partir de la cual se compactan las mediciones
+        tamano_lote: Filas procesadas por transacción
+        pausa: Espera entre lotes para que entren otros escritores
+    Returns:
+        int: Cantidad de mediciones crudas compactadas
+    """
+    corte = (datetime.now() - timedelta(days=dias)).strftime('%Y-%m-%d %H:%M:%S')
+    conn = db.get_connection()
+    conn.isolation_level = None  # transacciones manuales
+    total = 0
+
+    try:
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS lote_retencion (id_medicion INTEGER PRIMARY KEY)")
+
+        while True:
+            # IMMEDIATE toma el bloqueo de escritura al inicio y lo suelta en el COMMIT del lote
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("DELETE FROM lote_retencion")
+                conn.execute('''
+                    INSERT INTO lote_retencion
+                    SELECT id_medicion FROM mediciones
+                    WHERE fecha_medicion < ?
+                    ORDER BY fecha_medicion
+                    LIMIT ?
+                ''', (corte, tamano_lote))
+                filas = conn.execute("SELECT changes()").fetchone()[0]
+
+                if filas == 0:
+                    conn.execute("COMMIT")
+                    break
+
+                # Se suma a un resumen existente si llegan datos tardíos de la misma hora.
+                # Sin estación se usa -1: NULL en la clave nunca dispara el ON CONFLICT.
+                # Las filas sin parámetro no sirven para las tendencias y solo se eliminan.
+                conn.execute('''
+                    INSERT INTO mediciones_resumen
+                    (id_estacion, id_parametro, periodo, cantidad, suma, minimo, maximo)
+                    SELECT IFNULL(m.id_estacion, -1), m.id_parametro,
+                           strftime('%Y-%m-%d %H:00:00', m.fecha_medicion),
+                           COUNT(*), SUM(m.valor_medido), MIN(m.valor_medido), MAX(m.valor_medido)
+                    FROM mediciones m
+                    JOIN lote_retencion l ON l.id_medicion = m.id_medicion
+                    WHERE m.valor_medido IS NOT NULL AND m.id_parametro IS NOT NULL
+                    GROUP BY IFNULL(m.id_estacion, -1), m.id_parametro,
+                             strftime('%Y-%m-%d %H:00:00', m.fecha_medicion)
+                    ON CONFLICT (id_estacion, id_parametro, periodo) DO UPDATE SET
+                        cantidad = cantidad + excluded.cantidad,
+                        suma = suma + excluded.suma,
+                        minimo = MIN(minimo, excluded.minimo),
+                        maximo = MAX(maximo, excluded.maximo)
+                ''')
+                conn.execute('''
+                    DELETE FROM mediciones
+                    WHERE id_medicion IN (SELECT id_medicion FROM lote_retencion)
+                ''')
+                # mediciones no tiene triggers de versión: se invalida la caché una vez por lote
+                conn.execute("UPDATE versiones_tablas SET version = version + 1 WHERE tabla = 'mediciones'")
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+            total += filas
+            time.sleep(pausa)
+    finally:
+        conn.close()
+
+    return total
+
+
+def tamano_base(conn):
+    """Bytes ocupados por la base y bytes libres dentro del archivo"""
+    tamano_pagina = conn.execute("PRAGMA page_size").fetchone()[0]
+    paginas = conn.execute("PRAGMA page_count").fetchone()[0]
+    libres = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    return paginas * tamano_pagina, libres * tamano_pagina
+
+
+def mantener_base(db, paginas=None, directorio_copia=None, convertir=False):
+    """
+    Devuelve al disco las páginas libres y opcionalmente guarda una copia compactada
+    Args:
+        db: DatabaseManager
+        paginas: Máximo de páginas a liberar (None = todas)
+        directorio_copia: Si se indica, genera una copia con VACUUM INTO
+        convertir: Pasar una base antigua a auto_vacuum incremental con un VACUUM
+            completo, que bloquea la base durante toda la reescritura
+    Returns:
+        dict: Tamaños antes y después, y ruta de la copia
+    """
+    conn = db.get_connection()
+    conn.isolation_level = None
+
+    try:
+        tamano_antes, _ = tamano_base(conn)
+
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            # Pasar a vacuum incremental requiere un VACUUM completo una única vez;
+            # no se hace por defecto porque bloquea a todos los escritores
+            if convertir:
+                logger.info("Convirtiendo la base a auto_vacuum incremental (VACUUM completo)")
+                conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+                conn.execute("VACUUM")
+            else:
+                logger.warning(
+                    "La base no usa auto_vacuum incremental: el espacio libre no se devuelve "
+                    "al disco. Ejecutar una vez con --convertir en una ventana de mantenimiento."
+                )
+        else:
+            # Cada paso del PRAGMA libera una página; executescript lo ejecuta hasta
+            # el final, mientras que execute() se detiene después del primer paso
+            if paginas:
+                conn.executescript(f"PRAGMA incremental_vacuum({int(paginas)});")
+            else:
+                conn.executescript("PRAGMA incremental_vacuum;")
+
+        copia = None
+        if directorio_copia:
+            os.makedirs(directorio_copia, exist_ok=True)
+            nombre = f"puerto_huacho_{datetime.now().strftime('%Y%m%d_%H%M%S')}.db"
+            copia = os.path.join(directorio_copia, nombre)
+            conn.execute("VACUUM INTO ?", (copia,))
+
+        conn.execute("PRAGMA optimize")
+        tamano_despues, libres_despues = tamano_base(conn)
+    finally:
+        conn.close()
+
+    return {
+        'bytes_antes': tamano_antes,
+        'bytes_despues': tamano_despues,
+        'bytes_recuperados': tamano_antes - tamano_despues,
+        'bytes_libres_restantes': libres_despues,
+        'copia': copia
+    }
+
+
+def ejecutar_retencion(db, snapshot=None, dias=RETENCION_DIAS, directorio_copia=None,
+                       convertir=False):
+    """
+    Ejecuta la compactación y el mantenimiento, y devuelve un informe
+    Args:
+        db: DatabaseManager
+        snapshot: ColumnarSnapshot a reconstruir si se eliminaron filas
+        dias: Antigüedad de retención de las mediciones crudas
+        directorio_copia: Directorio para la copia con VACUUM INTO (opcional)
+        convertir: Ver mantener_base()
+    Returns:
+        dict: Informe de la ejecución
+    """
+    inicio = time.time()
+    compactadas = compactar_mediciones(db, dias=dias)
+
+    # El snapshot tiene copias de las filas eliminadas: se reconstruye aquí, en una
+    # generación nueva, mientras las peticiones web siguen leyendo la actual
+    if compactadas and snapshot is not None:
+        snapshot.rebuild()
+
+    informe = mantener_base(db, directorio_copia=directorio_copia, convertir=convertir)
+    informe['mediciones_compactadas'] = compactadas
+    informe['duracion_segundos'] = round(time.time() - inicio, 2)
+
+    logger.info(
+        f"Retención: {compactadas} mediciones compactadas, "
+        f"{informe['bytes_recuperados'] / 1024:.1f} KB recuperados "
+        f"({informe['bytes_despues'] / 1024:.1f} KB en uso) en {informe['duracion_segundos']} s"
+    )
+    return informe
+
+
+if __name__ == '__main__':
+    from database.models import DatabaseManager
+    from database.columnar import ColumnarSnapshot
+
+    parser = argparse.ArgumentParser(description='Retención y compactación de mediciones')
+    parser.add_argument('--dias', type=int, default=RETENCION_DIAS,
+                        help='Antigüedad (días) a partir de la cual se compactan las mediciones')
+    parser.add_argument('--intervalo-horas', type=float, default=0,
+                        help='Repetir cada N horas (0 = una sola ejecución)')
+    parser.add_argument('--copia', default=os.environ.get('RETENCION_COPIA'),
+                        help='Directorio donde guardar una copia compactada (VACUUM INTO)')
+    parser.add_argument('--convertir', action='store_true',
+                        help='Pasar una base antigua a auto_vacuum incremental (VACUUM completo, '
+                             'bloquea la base; usar en una ventana de mantenimiento)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    db = DatabaseManager()
+    snapshot = ColumnarSnapshot(db)
+
+    while True:
+        try:
+            ejecutar_retencion(db, snapshot, dias=args.dias, directorio_copia=args.copia,
+                               convertir=args.convertir)
+            args.convertir = False  # la conversión se hace una sola vez
+        except Exception as e:
+            logger.error(f"Error en la retención de mediciones: {e}")
+
+        if not args.intervalo_horas:
+            break
+        time.sleep(args.intervalo_horas * 3600)
@@ -0,0 +1,381 @@
+"""
+Receptor de mediciones por protocolo de líneas para gateways de sensores.
+
+Alternativa liviana a POST /api/monitoreo: cada línea es una medición y
+un solo proceso asyncio atiende miles de conexiones TCP persistentes y
+datagramas UDP. Las mediciones válidas se acumulan en una cola y se
+guardan por lotes con executemany en un hilo aparte.
+
+Formato de línea (separado por comas, termina en salto de línea):
+    estacion,parametro,valor[,timestamp[,dispositivo]]
+
+    estacion     id_estacion o nombre_estacion
+    parametro    id_parametro o nombre_parametro
+    valor        número validado con validar_numero()
+    timestamp    segundos epoch o fecha ISO (YYYY-MM-DDTHH:MM:SS); si falta
+                 se usa la hora de llegada
+    dispositivo  identificador del emisor; con timestamp y dispositivo los
+                 reenvíos de la misma lectura se descartan (índice único por
+                 dispositivo, parámetro y hora del dispositivo)
+
+    Ejemplo:  1,pH,7.82,1760880000,boya-17
+
+Por TCP las líneas inválidas se responden con "ERR <motivo>"; las válidas
+no tienen respuesta para no frenar al emisor.
+
+Uso (desde la raíz del proyecto):
+    python receptor_sensores.py [--puerto-tcp 9100] [--puerto-udp 9100]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import signal
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from database.models import DatabaseManager
+from validacion import validar_numero, validar_timestamp
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Configuración por variables de entorno (sobrescribible por argumentos)
+RECEPTOR_HOST = os.environ.get('RECEPTOR_HOST', '0.0.0.0')
+RECEPTOR_PUERTO_TCP = int(os.environ.get('RECEPTOR_PUERTO_TCP', 9100))
+RECEPTOR_PUERTO_UDP = int(os.environ.get('RECEPTOR_PUERTO_UDP', 9100))
+TAMANO_LOTE = int(os.environ.get('RECEPTOR_LOTE', 1000))
+INTERVALO_LOTE = float(os.environ.get('RECEPTOR_INTERVALO', 0.5))  # segundos
+TAMANO_COLA = 100000
+LONGITUD_MAXIMA_LINEA = 1024
+SEGUNDOS_RECARGA_CATALOGO = 30
+PAUSA_REINTENTO = 0.5  # segundos; se duplica en cada reintento hasta PAUSA_MAXIMA_REINTENTO
+PAUSA_MAXIMA_REINTENTO = 30
+REINTENTOS_AL_DETENER = 5
+
+
+class Catalogo:
+    """Estaciones y parámetros en memoria para resolver ids o nombres sin consultar la base"""
+
+    def __init__(self, db):
+        self.db = db
+        self.estaciones = {}
+        self.parametros = {}
+        self.ultima_carga = 0
+        self.cargar()
+
+    def cargar(self):
+        conn = self.db.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT id_estacion, nombre_estacion FROM estaciones_monitoreo")
+        estaciones = cursor.fetchall()
+        cursor.execute("SELECT id_parametro, nombre_parametro FROM parametros_ambientales")
+        parametros = cursor.fetchall()
+        conn.close()
+
+        self.estaciones = self._indexar(estaciones)
+        self.parametros = self._indexar(parametros)
+        self.ultima_carga = time.monotonic()
+
+    @staticmethod
+    def _indexar(filas):
+        """Claves: el id como texto y el nombre en minúsculas"""
+        indice = {}
+        for id_fila, nombre in filas:
+            indice[str(id_fila)] = id_fila
+            if nombre:
+                indice[nombre.strip().lower()] = id_fila
+        return indice
+
+    def resolver(self, indice, clave):
+        """Busca un id; si no existe, recarga el catálogo como máximo cada 30 segundos"""
+        clave = clave.strip().lower()
+        if clave not in getattr(self, indice) and \
+                time.monotonic() - self.ultima_carga > SEGUNDOS_RECARGA_CATALOGO:
+            self.cargar()
+        return getattr(self, indice).get(clave)
+
+
+def interpretar_linea(linea, catalogo):
+    """
+    Valida una línea del protocolo
+    Args:
+        linea: Texto sin el salto de línea
+        catalogo: Catalogo para resolver estaciones y parámetros
+    Returns:
+        tuple: (id_estacion, id_parametro, valor, fecha_medicion, fecha_dispositivo, id_dispositivo)
+    Raises:
+        ValueError: Si la línea no cumple el formato
+    """
+    campos = linea.split(',')
+    if len(campos) not in (3, 4, 5):
+        raise ValueError("se esperaban de 3 a 5 campos: estacion,parametro,valor[,timestamp[,dispositivo]]")
+
+    id_estacion = catalogo.resolver('estaciones', campos[0])
+    if id_estacion is None:
+        raise ValueError(f"estación desconocida: {campos[0]}")
+
+    id_parametro = catalogo.resolver('parametros', campos[1])
+    if id_parametro is None:
+        raise ValueError(f"parámetro desconocido: {campos[1]}")
+
+    valor = validar_numero(campos[2], campos[1].strip())
+
+    if len(campos) >= 4 and campos[3].strip():
+        fecha_dispositivo = validar_timestamp(campos[3].strip())
+        fecha = fecha_dispositivo[:19]  # fecha_medicion va sin fracción de segundo
+    else:
+        fecha_dispositivo = None
+        fecha = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+    dispositivo = campos[4].strip() if len(campos) == 5 else ''
+
+    return id_estacion, id_parametro, valor, fecha, fecha_dispositivo, dispositivo or None
+
+
+class ReceptorSensores:
+    """Servidor TCP/UDP que valida líneas y escribe las mediciones por lotes"""
+
+    def __init__(self, db, tamano_lote=TAMANO_LOTE, intervalo=INTERVALO_LOTE):
+        self.db = db
+        self.catalogo = Catalogo(db)
+        self.tamano_lote = tamano_lote
+        self.intervalo = intervalo
+        self.cola = None
+        # Un solo hilo escritor: la conexión SQLite se crea y se usa siempre en él
+        self.escritor = ThreadPoolExecutor(max_workers=1)
+        self.conexion = None
+        self.pendiente = []   # lote sacado de la cola y todavía no guardado
+        self.en_curso = None  # Future del guardado en el hilo escritor
+        self.estadisticas = {
+            'conexiones': 0, 'guardadas': 0, 'duplicadas': 0, 'rechazadas': 0, 'descartadas_udp': 0
+        }
+
+    # ==================== ENTRADA ====================
+
+    def procesar_linea(self, linea):
+        """Interpreta una línea y devuelve la medición o el motivo del rechazo"""
+        try:
+            return interpretar_linea(linea, self.catalogo), None
+        except ValueError as e:
+            self.estadisticas['rechazadas'] += 1
+            return None, str(e)
+
+    async def atender_tcp(self, reader, writer):
+        """Atiende una conexión TCP persistente, una medición por línea"""
+        self.estadisticas['conexiones'] += 1
+        try:
+            while True:
+                try:
+                    datos = await reader.readline()
+                except (asyncio.LimitOverrunError, ValueError):
+                    writer.write(b"ERR linea demasiado larga\n")
+                    break
+                if not datos:
+                    break
+
+                linea = datos.decode('utf-8', errors='replace').strip()
+                if not linea:
+                    continue
+
+                medicion, error = self.procesar_linea(linea)
+                if medicion:
+                    # Si la cola está llena se deja de leer: el emisor recibe contrapresión TCP
+                    await self.cola.put(medicion)
+                else:
+                    writer.write(f"ERR {error}\n".encode('utf-8'))
+                    await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            # Al detener el receptor las conexiones abiertas se cancelan: terminan sin error
+            pass
+        finally:
+            self.estadisticas['conexiones'] -= 1
+            writer.close()
+
+    def recibir_datagrama(self, datos):
+        """Procesa un datagrama UDP que puede traer varias líneas"""
+        for linea in datos.decode('utf-8', errors='replace').splitlines():
+            linea = linea.strip()
+            if not linea:
+                continue
+            medicion, _ = self.procesar_linea(linea)
+            if medicion:
+                try:
+                    self.cola.put_nowait(medicion)
+                except asyncio.QueueFull:
+                    self.estadisticas['descartadas_udp'] += 1
+
+    # ==================== ESCRITURA POR LOTES ====================
+
+    def guardar_lote(self, lote):
+        """
+        Inserta un lote de mediciones (se ejecuta en el hilo escritor)
+        Returns:
+            int: Mediciones insertadas; los reenvíos ya guardados se ignoran
+        """
+        if self.conexion is None:
+            self.conexion = self.db.get_connection()
+        try:
+            cursor = self.conexion.executemany('''
+                INSERT INTO mediciones
+                (id_estacion, id_parametro, valor_medido, fecha_medicion, fecha_dispositivo,
+                 id_dispositivo, responsable_medicion)
+                VALUES (?, ?, ?, ?, ?, ?, 'Sistema Automático')
+                ON CONFLICT DO NOTHING
+            ''', lote)
+            self.conexion.commit()
+        except Exception:
+            # Sin rollback la transacción a medias quedaría abierta para el próximo lote
+            try:
+                self.conexion.rollback()
+            except sqlite3.Error:
+                self.conexion.close()
+                self.conexion = None
+            raise
+        return cursor.rowcount
+
+    def contar_guardadas(self, lote, insertadas):
+        self.estadisticas['guardadas'] += insertadas
+        self.estadisticas['duplicadas'] += len(lote) - insertadas
+
+    async def guardar_con_reintentos(self, lote):
+        """
+        Guarda un lote reintentando con espera creciente mientras la base esté
+        bloqueada (por ejemplo, durante el mantenimiento). Mientras tanto la cola
+        se llena y los emisores TCP reciben contrapresión en lugar de perder datos.
+        Returns:
+            int: Mediciones insertadas, o None si el lote no se pudo guardar
+        """
+        pausa = PAUSA_REINTENTO
+        while True:
+            self.en_curso = self.escritor.submit(self.guardar_lote, lote)
+            try:
+                insertadas = await asyncio.wrap_future(self.en_curso)
+                self.en_curso = None
+                return insertadas
+            except sqlite3.OperationalError as e:
+                self.en_curso = None
+                logger.warning(
+                    f"No se pudo guardar un lote de {len(lote)} mediciones ({e}); "
+                    f"reintento en {pausa:.1f} s"
+                )
+                await asyncio.sleep(pausa)
+                pausa = min(pausa * 2, PAUSA_MAXIMA_REINTENTO)
+            except Exception as e:
+                self.en_curso = None
+                logger.error(f"Error al guardar lote de {len(lote)} mediciones: {e}")
+                return None
+
+    async def escribir_lotes(self):
+        """Vacía la cola en lotes de hasta tamano_lote mediciones"""
+        while True:
+            lote = self.pendiente = [await self.cola.get()]
+            # Esperar un poco deja acumular un lote en lugar de escribir fila por fila
+            if self.cola.qsize() < self.tamano_lote:
+                await asyncio.sleep(self.intervalo)
+            while len(lote) < self.tamano_lote and not self.cola.empty():
+                lote.append(self.cola.get_nowait())
+
+            insertadas = await self.guardar_con_reintentos(lote)
+            self.pendiente = []
+            if insertadas is not None:
+                self.contar_guardadas(lote, insertadas)
+
+    def vaciar_cola(self):
+        """Guarda el lote pendiente y lo que quedó en la cola al detener el receptor"""
+        lote = self.pendiente
+        self.pendiente = []
+        if self.en_curso is not None and not self.en_curso.cancelled():
+            # El lote interrumpido ya se estaba guardando: se espera el resultado
+            try:
+                self.contar_guardadas(lote, self.en_curso.result())
+                lote = []
+            except Exception:
+                pass
+        while not self.cola.empty():
+            lote.append(self.cola.get_nowait())
+        if not lote:
+            return
+
+        pausa = PAUSA_REINTENTO
+        for _ in range(REINTENTOS_AL_DETENER):
+            try:
+                self.contar_guardadas(lote, self.escritor.submit(self.guardar_lote, lote).result())
+                return
+            except sqlite3.OperationalError as e:
+                logger.warning(f"No se pudo guardar el último lote ({e}); reintento en {pausa:.1f} s")
+                time.sleep(pausa)
+                pausa *= 2
+        logger.error(f"Se descartaron {len(lote)} mediciones al detener el receptor")
+
+    async def informar(self, cada=60):
+        while True:
+            await asyncio.sleep(cada)
+            logger.info(f"Receptor: {self.estadisticas}")
+
+    # ==================== ARRANQUE ====================
+
+    async def ejecutar(self, host, puerto_tcp, puerto_udp):
+        loop = asyncio.get_running_loop()
+        self.cola = asyncio.Queue(maxsize=TAMANO_COLA)
+
+        # Las plataformas del Procfile detienen el proceso con SIGTERM: se cancela
+        # esta tarea para que el finally guarde lo que quedó en la cola
+        try:
+            loop.add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+        except NotImplementedError:  # Windows
+            pass
+
+        tareas = [asyncio.create_task(self.escribir_lotes()), asyncio.create_task(self.informar())]
+        servidores = []
+
+        if puerto_tcp:
+            servidor = await asyncio.start_server(
+                self.atender_tcp, host, puerto_tcp,
+                limit=LONGITUD_MAXIMA_LINEA, backlog=1024
+            )
+            servidores.append(servidor)
+            logger.info(f"Escuchando TCP en {host}:{puerto_tcp}")
+
+        if puerto_udp:
+            receptor = self
+
+            class ProtocoloUDP(asyncio.DatagramProtocol):
+                def datagram_received(self, datos, direccion):
+                    receptor.recibir_datagrama(datos)
+
+            transporte, _ = await loop.create_datagram_endpoint(
+                ProtocoloUDP, local_addr=(host, puerto_udp)
+            )
+            servidores.append(transporte)
+            logger.info(f"Escuchando UDP en {host}:{puerto_udp}")
+
+        try:
+            await asyncio.gather(*tareas)
+        except asyncio.CancelledError:
+            logger.info("Deteniendo receptor...")
+        finally:
+            for servidor in servidores:
+                servidor.close()
+            for tarea in tareas:
+                tarea.cancel()
+            self.vaciar_cola()
+            logger.info(f"Receptor detenido: {self.estadisticas}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Receptor de mediciones por protocolo de líneas')
+    parser.add_argument('--host', default=RECEPTOR_HOST)
+    parser.add_argument('--puerto-tcp', type=int, default=RECEPTOR_PUERTO_TCP, help='0 desactiva TCP')
+    parser.add_argument('--puerto-udp', type=int, default=RECEPTOR_PUERTO_UDP, help='0 desactiva UDP')
+    parser.add_argument('--lote', type=int, default=TAMANO_LOTE, help='Mediciones por transacción')
+    args = parser.parse_args()
+
+    print("📡 Iniciando receptor de sensores...")
+    receptor = ReceptorSensores(DatabaseManager(), tamano_lote=args.lote)
+    try:
+        asyncio.run(receptor.ejecutar(args.host, args.puerto_tcp, args.puerto_udp))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,55 @@
+"""Validaciones compartidas por la aplicación web y el receptor de sensores"""
+from datetime import datetime
+
+
+def validar_numero(valor, nombre_campo="valor"):
+    """
+    Valida que un valor sea un número válido
+    Args:
+        valor: El valor a validar
+        nombre_campo: Nombre del campo para el mensaje de error
+    Returns:
+        float: El valor convertido a float
+    Raises:
+        ValueError: Si el valor no es válido
+    """
+    try:
+        numero = float(valor)
+        if numero < -100 or numero > 1000:  # Rango razonable para datos ambientales
+            raise ValueError(f"{nombre_campo} fuera del rango válido (-100 a 1000)")
+        return numero
+    except (ValueError, TypeError):
+        raise ValueError(f"{nombre_campo} debe ser un número válido")
+
+
+def validar_timestamp(valor, nombre_campo="timestamp"):
+    """
+    Convierte la hora enviada por un dispositivo al formato de fecha_medicion
+    Args:
+        valor: Segundos epoch (número o texto) o fecha ISO (YYYY-MM-DDTHH:MM:SS,
+            con fracción de segundo y zona horaria o 'Z' opcionales)
+        nombre_campo: Nombre del campo para el mensaje de error
+    Returns:
+        str: Fecha con formato YYYY-MM-DD HH:MM:SS.ffffff (hora local del
+            servidor). Se conserva la fracción de segundo para que dos lecturas
+            del mismo segundo no se tomen por un reenvío; los primeros 19
+            caracteres tienen el formato de fecha_medicion.
+    Raises:
+        ValueError: Si el valor no es una fecha válida
+    """
+    try:
+        fecha = datetime.fromtimestamp(float(valor))
+    except (OverflowError, OSError):
+        raise ValueError(f"{nombre_campo} fuera de rango")
+    except (ValueError, TypeError):
+        texto = str(valor).strip()
+        # fromisoformat() no acepta el sufijo 'Z' hasta Python 3.11
+        if texto[-1:] in ('Z', 'z'):
+            texto = texto[:-1] + '+00:00'
+        try:
+            fecha = datetime.fromisoformat(texto)
+        except ValueError:
+            raise ValueError(f"{nombre_campo} debe ser segundos epoch o fecha ISO")
+        if fecha.tzinfo:
+            fecha = fecha.astimezone().replace(tzinfo=None)
+    return fecha.strftime('%Y-%m-%d %H:%M:%S.%f')